@@ -0,0 +1,60 @@
+from datetime import datetime
+from flask import Blueprint, current_app, render_template, session, flash, redirect
+from sqlalchemy import delete
+from extensions import db, cache
+from models import User, Product, StockReservation, Job, Notification
+from helpers import logged_in, current_user
+from store import invalidate_products, stock_changed
+from stock import release_stock
+from jobs import enqueue
+
+# The account page and deleting an account.
+bp = Blueprint('account', __name__)
+
+@bp.route('/account')
+@logged_in
+def account():
+    notifications = db.session.query(Notification).filter_by(user_id=session.get('userid')).order_by(Notification.id.desc()).limit(current_app.config['NOTIFICATIONS_PER_PAGE']).all()
+    page = render_template('/pages/account.html', userid=session.get('userid'), notifications=notifications)
+    # shown once as new
+    unread = [notification.id for notification in notifications if notification.read_at is None]
+    if unread:
+        db.session.query(Notification).filter(Notification.id.in_(unread)).update({Notification.read_at: datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+    return page
+@bp.route('/account/<int:account_id>/delete', methods=['POST'])
+@logged_in
+def delete_submission(account_id):
+    # find the account
+    user = current_user()
+    if user.id != session.get('userid'):
+        flash('You\'re are not allowed to delete other users accounts', 'error')
+        # actually going to sign the particular person out
+        return redirect('/signout')
+    
+    user_id = user.id
+    try:
+        # give back any stock held by the users cart, then delete the account
+        released = release_stock(db, Product, StockReservation, user_id)
+        if current_app.config['ACCOUNT_DELETION'] == 'soft':
+            # hidden right away (load_user and sign in skip it), the worker purges its products and rows in batches
+            db.session.query(User).filter_by(id=user_id).update({User.deleted_at: datetime.utcnow()}, synchronize_session=False)
+            enqueue(db, Job, 'purge_account', {'user_id': user_id}, key=f'purge_account:{user_id}', max_attempts=current_app.config['JOB_MAX_ATTEMPTS'])
+        else:
+            # one DELETE, the database cascades it to the products (and their lines in every cart), the cart, reservations and orders
+            db.session.execute(delete(User).where(User.id == user_id))
+        db.session.commit()
+        invalidate_products(user_id, list(released))
+        # the stock the cart held is back on the products
+        stock_changed(released)
+        # the sellers products are gone (or no longer listed, see Product.listed) without their ids ever being loaded, drop every cached product
+        cache.invalidate('product')
+        flash('Account Deleted.', 'success')
+        # clear the session
+        session.clear()
+        return redirect('/')
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        flash('Could not delete your account. Try again.', 'error')
+        return redirect('/account')
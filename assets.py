@@ -0,0 +1,162 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+from werkzeug.security import safe_join
+
+# Static files are linked through fingerprinted names (css/main.css -> /assets/css/main.<digest>.css). The digest
+# changes with the content, so a fingerprinted url can be cached by browsers for good.
+#
+# "flask build-assets" goes further: it bundles the files of each of ASSET_BUNDLES, minifies them and writes
+# <build dir>/<name>.<digest><extension> with a .gz and (with the brotli package) a .br copy next to it, then
+# manifest.json mapping each bundle to its file. Once a manifest exists pages link to the built bundles, until then
+# they link to the source files of each bundle.
+
+# brotli is optional, without it only gzip copies are written
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST = 'manifest.json'
+
+FINGERPRINTED = re.compile(r'^(?P<stem>.+)\.(?P<digest>[0-9a-f]{12})(?P<extension>\.\w+)$')
+
+# {path: (mtime, digest)}
+_digests = {}
+
+def file_digest(path):
+    """ Short sha256 of a files content, recomputed only when the file changes. """
+    mtime = os.path.getmtime(path)
+    cached = _digests.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    _digests[path] = (mtime, digest)
+    return digest
+
+def asset_url(static_folder, filename):
+    """ Fingerprinted url of a file in static/. """
+    stem, extension = os.path.splitext(filename)
+    return f'/assets/{stem}.{file_digest(os.path.join(static_folder, filename))}{extension}'
+
+def asset_urls(static_folder, build_dir, bundles, name):
+    """ Urls to load a bundle from: its built file when there is a build, otherwise each of its source files. """
+    built = load_manifest(build_dir).get(name)
+    if built:
+        return [f'/assets/{built}']
+    return [asset_url(static_folder, filename) for filename in bundles.get(name, [name])]
+
+# {path: (mtime, manifest)}
+_manifests = {}
+
+def load_manifest(build_dir):
+    """ {bundle: built file} of the last build, {} when there is none. Reread only when a build replaces it. """
+    path = os.path.join(build_dir, MANIFEST)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    cached = _manifests.get(path)
+    if not cached or cached[0] != mtime:
+        with open(path) as f:
+            cached = _manifests[path] = (mtime, json.load(f))
+    return cached[1]
+
+def split_fingerprint(filename):
+    """ (filename without the fingerprint, digest), or (filename, None) when it has none. """
+    match = FINGERPRINTED.match(filename)
+    if not match:
+        return filename, None
+    return match.group('stem') + match.group('extension'), match.group('digest')
+
+def static_version(static_folder, build_dir=None):
+    """ One digest over every static file (and the build manifest), part of page ETags since pages link to the fingerprinted names. """
+    digest = hashlib.sha256()
+    if build_dir and os.path.exists(os.path.join(build_dir, MANIFEST)):
+        digest.update(file_digest(os.path.join(build_dir, MANIFEST)).encode())
+    for root, _, files in sorted(os.walk(static_folder)):
+        for name in sorted(files):
+            if name.startswith('.'):
+                continue
+            digest.update(name.encode())
+            digest.update(file_digest(os.path.join(root, name)).encode())
+    return digest.hexdigest()[:12]
+
+#------------
+# Build
+#------------
+def minify_css(css):
+    """ Comments and needless whitespace taken out (rcssmin does it when installed). """
+    try:
+        import rcssmin
+        return rcssmin.cssmin(css)
+    except ImportError:
+        pass
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    return css.replace(';}', '}').strip()
+
+def minify_js(js):
+    """ Indentation, blank lines and comment lines taken out (rjsmin minifies properly when installed). Line breaks are
+    kept, without a parser joining lines could change what automatic semicolon insertion does. """
+    try:
+        import rjsmin
+        return rjsmin.jsmin(js)
+    except ImportError:
+        pass
+    lines = (line.strip() for line in js.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+# keeps one file from running into the next (a missing semicolon, an unclosed comment)
+SEPARATORS = {'.css': '\n', '.js': ';\n'}
+
+def build_assets(static_folder, build_dir, bundles):
+    """ Builds every bundle ({name: [files in static/]}) into build_dir and writes the manifest last, so pages only
+    switch to a build once all of it is there. Files of earlier builds are kept for pages still linking to them.
+    Returns {name: {'file', 'source', 'minified', 'gzip', 'br'}} with the sizes in bytes. """
+    manifest, report = {}, {}
+    for name, files in bundles.items():
+        stem, extension = os.path.splitext(name)
+        sources = []
+        for filename in files:
+            with open(os.path.join(static_folder, filename), encoding='utf-8') as f:
+                sources.append(f.read())
+        minify = MINIFIERS.get(extension, lambda text: text)
+        data = SEPARATORS.get(extension, '\n').join(minify(source) for source in sources).encode()
+        built = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{extension}'
+        path = os.path.join(build_dir, built)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # mtime=0 so building the same content twice writes the same bytes
+        variants = {'': data, '.gz': gzip.compress(data, 9, mtime=0)}
+        if brotli is not None:
+            variants['.br'] = brotli.compress(data, quality=11)
+        for suffix, content in variants.items():
+            _write(path + suffix, content)
+        manifest[name] = built
+        report[name] = {'file': built, 'source': sum(len(source.encode()) for source in sources), 'minified': len(data),
+                        'gzip': len(variants['.gz']), 'br': len(variants['.br']) if '.br' in variants else None}
+    _write(os.path.join(build_dir, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return report
+
+def _write(path, data):
+    # write then rename, so a request never gets half a file
+    temp_path = f'{path}.tmp{os.getpid()}'
+    with open(temp_path, 'wb') as temp:
+        temp.write(data)
+    os.replace(temp_path, path)
+
+def built_variant(build_dir, filename, accept_encodings):
+    """ (path, content encoding) of the best copy of a built file the client accepts, None when filename is not built. """
+    path = safe_join(build_dir, filename) if FINGERPRINTED.match(filename) else None
+    if path is None or not os.path.isfile(path):
+        return None
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if accept_encodings[encoding] and os.path.isfile(path + suffix):
+            return path + suffix, encoding
+    return path, None
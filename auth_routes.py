@@ -0,0 +1,117 @@
+from flask import Blueprint, render_template, session, flash, request, redirect
+from extensions import db, hasher, signin_limiter
+from models import User, Cart
+from helpers import logged_in, redirect_logged_in
+from passwords import HashingBusy
+
+# Sign up, sign in and sign out.
+bp = Blueprint('auth', __name__)
+
+@bp.route("/signup")
+@redirect_logged_in
+def signup():
+  return render_template('/forms/signup.html', userid=None)
+
+def username_exists(username):
+    return db.session.query(User).filter_by(username=username).first()
+
+@bp.route('/signup', methods=['POST'])
+@redirect_logged_in
+def signup_submission():
+  username = request.form.get('username')
+  password = request.form.get('password')
+  confirmation = request.form.get('confirmation')
+
+  # if user exist
+  if username_exists(username):
+    flash(f'A user with \'{username}\' already exists.', 'error')
+    return redirect('/signup')
+
+  # if password did not match confirmation
+  if password != confirmation:
+    flash("Password and confirmation do not match", "error")  
+# next template is in signup route handler (/forms/signup.html) since flash appears there
+    return redirect('/signup')
+
+  # everything passed, create the user
+  try:
+    password = hasher.hash(password)
+  except HashingBusy:
+    flash('We are very busy right now. Please try again in a moment.', 'error')
+    return redirect('/signup')
+  temp = User(username=username, password=password)
+  try:
+    # adding to transaction in current session, INSERT
+    db.session.add(temp)
+    # creating a cart for the current user
+    temp_cart = Cart(cart_user=temp)
+    db.session.add(temp_cart)
+    # flash user with success message, and redirect for user to sign in to acc
+    # committing the transaction to be saved
+    db.session.commit()
+    flash('User created!', 'success')
+    return redirect('/signin')
+  except Exception as e:
+    print(e)
+    # clearing the transaction, to keep balanced state of db
+    db.session.rollback()
+    # flash user, redirect to sign up page, so that flash next is called (revealing error)
+    flash('Oh no, could not create user. Try again please.', 'error')
+    return redirect('/signup')
+
+@bp.route('/signin')
+@redirect_logged_in
+def signin():
+  return render_template('/forms/signin.html', userid=None)
+
+@bp.route('/signin', methods=['POST'])
+@redirect_logged_in
+def signin_submission():
+  username = request.form.get('username')
+  password = request.form.get('password')
+
+  # checked before any lookup or hashing, so a credential stuffing burst costs (almost) nothing
+  keys = (f'ip:{request.remote_addr}', f'username:{username}')
+  if not signin_limiter.allow(*keys):
+      flash('Too many sign in attempts. Please wait a minute and try again.', 'error')
+      # the form itself, browsers do not follow a redirect sent with a 429
+      return render_template('/forms/signin.html', userid=None), 429, {'Retry-After': str(max(signin_limiter.retry_after(*keys), 1))}
+
+  user = username_exists(username) 
+
+  # check that the username does exist (a deleted account waiting for its purge does not)
+  if not user or user.deleted_at:
+      flash(f'{username} does not exist. Please try again.', 'error')
+      return redirect('/signin')
+  # check that password equals password in database
+  try:
+      if not hasher.verify(user.password, password):
+          flash(f'Invalid password given for {username}. Please try again', 'error')
+          return redirect('/signin')
+      # hashed with older settings (method / cost changed since), store it with the current ones
+      if hasher.needs_rehash(user.password):
+          user.password = hasher.hash(password)
+          db.session.commit()
+  except HashingBusy:
+      flash('We are very busy right now. Please try again in a moment.', 'error')
+      return redirect('/signin')
+
+  # if successful flash user ;)
+  flash(f'You\'re now logged in. Welcome {username} :)', 'success')
+  # - sign in the user, redirect to home page
+  session['userid'] = user.id
+  session['username'] = username
+  #redirect the user back to home page
+  return redirect('/')
+
+@bp.route('/signout')
+@logged_in
+def signout():
+    if session.get('userid'):
+        # removing the user info from session "signed out"
+        session.clear()
+        flash('You\'re now signed out', 'success')
+        return redirect('/')
+    else:
+        flash('You are not signed in.', 'info')
+        return redirect('/') 
@@ -0,0 +1,313 @@
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, Request, build_opener
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# Benchmark of the main routes: seeds users, products and cart rows, then drives every route through the flask test
+# client (or a running server with --url) and reports p50 / p95 / p99 latency, throughput and SQL queries per request.
+# Query counts do not depend on the machine, so comparing them to a stored baseline catches N+1 regressions anywhere:
+#
+#   python bench.py                                   # fresh sqlite database in a temp dir
+#   python bench.py --save-baseline bench_baseline.json
+#   python bench.py --compare bench_baseline.json     # exits 1 when a route got slower or runs more queries
+#   DATABASE_URL=postgresql://... python bench.py     # a scratch database, it gets seeded with bench rows
+#   python bench.py --url http://localhost:5000       # a running server on the same DATABASE_URL (no query counts)
+
+WORDS = ('blue', 'red', 'pen', 'laptop', 'chair', 'lamp', 'phone', 'desk', 'book', 'mug', 'fast', 'wooden', 'small', 'large')
+PASSWORD = 'bench-password'
+
+#------------
+# Drivers
+#------------
+class TestClientDriver:
+    """ Requests through the flask test client, in process. """
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None, json_body=None):
+        return self.client.open(path, method=method, data=data, json=json_body).status_code
+
+class _NoRedirects(HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+class HttpDriver:
+    """ Requests to a running server, with its own cookie jar (one signed in browser). """
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()), _NoRedirects)
+
+    def request(self, method, path, data=None, json_body=None):
+        headers = {}
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            body = urlencode(data).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            with self.opener.open(Request(self.url + path, data=body, headers=headers, method=method)) as response:
+                response.read()
+                return response.status
+        except HTTPError as e:
+            # redirects land here too (not followed, like the test client)
+            return e.code
+
+#------------
+# Scenarios
+#------------
+# (name, function(worker) -> (method, path, form data, json body)), run in this order on every iteration
+def _signup(worker):
+    worker.signups += 1
+    username = f'bench-new-{worker.index}-{worker.signups}-{random.randrange(10 ** 9)}'
+    return 'POST', '/signup', {'username': username, 'password': PASSWORD, 'confirmation': PASSWORD}, None
+
+def _signin(worker):
+    return 'POST', '/signin', {'username': worker.username, 'password': PASSWORD}, None
+
+def _product(worker):
+    return 'GET', f'/products/{random.choice(worker.product_ids)}', None, None
+
+def _search(worker):
+    return 'GET', '/search?' + urlencode({'query': ' '.join(random.sample(WORDS, 2))}), None, None
+
+def _cart_add(worker):
+    worker.picked = random.choice(worker.product_ids)
+    return 'POST', '/cart/add', None, {'id': worker.picked}
+
+def _cart_exist(worker):
+    return 'POST', '/cart/exist', None, {'ids': random.sample(worker.product_ids, min(24, len(worker.product_ids)))}
+
+def _cart_batch(worker):
+    ids = random.sample(worker.product_ids, min(5, len(worker.product_ids)))
+    return 'POST', '/cart/batch', None, {'operations': [{'op': 'add', 'id': id_, 'quantity': 1} for id_ in ids]}
+
+SCENARIOS = [
+    ('signup', _signup),
+    ('signin', _signin),
+    ('catalog', lambda worker: ('GET', '/', None, None)),
+    ('catalog_page_2', lambda worker: ('GET', f'/?format=json&after={worker.second_page}', None, None)),
+    ('seller_products', lambda worker: ('GET', '/products', None, None)),
+    ('product', _product),
+    ('search', _search),
+    ('cart_add', _cart_add),
+    ('cart_exist', _cart_exist),
+    ('cart', lambda worker: ('GET', '/cart', None, None)),
+    ('cart_remove', lambda worker: ('POST', '/cart/remove', None, {'id': worker.picked})),
+    ('cart_batch', _cart_batch),
+    ('cart_clear', lambda worker: ('GET', '/cart/clear', None, None)),
+    ('signout', lambda worker: ('GET', '/signout', None, None)),
+]
+
+#------------
+# Seeding
+#------------
+def seed(app, users, products, cart_rows):
+    """ Adds bench users (with carts holding cart_rows products each) and their products. Returns (usernames, product ids). """
+    from extensions import db, hasher
+    from models import User, Cart, CartLine, Product
+    run = f'{int(time.time())}-{random.randrange(10 ** 6)}'
+    with app.app_context():
+        db.create_all()
+        # hashed once, hashing every seeded user would only benchmark the seeding
+        password = hasher.hash(PASSWORD)
+        accounts = [User(username=f'bench-{run}-{i}', password=password) for i in range(users)]
+        db.session.add_all(accounts)
+        db.session.flush()
+        db.session.add_all([Cart(user_id=user.id) for user in accounts])
+        # names are unique per seller, the number keeps the random ones apart
+        db.session.add_all([Product(name=f'{" ".join(random.sample(WORDS, 2)).title()} {i}', description=' '.join(random.sample(WORDS, 4)), price=round(random.uniform(1, 100), 2),
+                                    total_stock=10 ** 6, image_link='https://example.com/bench.png', userid=user.id)
+                            for user in accounts for i in range(products)])
+        db.session.flush()
+        product_ids = [id_ for (id_,) in db.session.query(Product.id).filter(Product.userid.in_([user.id for user in accounts]))]
+        carts = db.session.query(Cart).filter(Cart.user_id.in_([user.id for user in accounts])).all()
+        db.session.add_all([CartLine(cart_id=cart.id, product_id=id_, quantity=1)
+                            for cart in carts for id_ in random.sample(product_ids, min(cart_rows, len(product_ids)))])
+        db.session.commit()
+        return [user.username for user in accounts], product_ids
+
+#------------
+# Running
+#------------
+class Worker:
+    """ One simulated browser: a signed in user going through every scenario, iterations times. """
+    def __init__(self, index, driver, username, product_ids, second_page):
+        self.index = index
+        self.driver = driver
+        self.username = username
+        self.product_ids = product_ids
+        self.second_page = second_page
+        self.picked = product_ids[0]
+        self.signups = 0
+        # {scenario: [(seconds, queries), ...]}
+        self.samples = {name: [] for name, _ in SCENARIOS}
+        self.errors = {}
+
+class QueryCounter:
+    """ Counts the SQL statements each thread sends, through the engines before_cursor_execute event. """
+    def __init__(self, engines):
+        self._local = threading.local()
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+def run_worker(worker, iterations, counter):
+    for _ in range(iterations):
+        for name, scenario in SCENARIOS:
+            method, path, data, json_body = scenario(worker)
+            if counter:
+                counter.reset()
+            start = time.perf_counter()
+            status = worker.driver.request(method, path, data, json_body)
+            elapsed = time.perf_counter() - start
+            if status >= 400:
+                worker.errors[name] = worker.errors.get(name, 0) + 1
+            worker.samples[name].append((elapsed, counter.count if counter else None))
+
+def percentile(values, fraction):
+    """ Nearest rank percentile of an already sorted list. """
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+def summarize(workers, wall_seconds):
+    """ {scenario: {'requests', 'errors', 'p50_ms', 'p95_ms', 'p99_ms', 'throughput', 'queries'}} """
+    report = {}
+    for name, _ in SCENARIOS:
+        samples = [sample for worker in workers for sample in worker.samples[name]]
+        if not samples:
+            continue
+        latencies = sorted(seconds for seconds, _ in samples)
+        queries = [count for _, count in samples if count is not None]
+        report[name] = {
+            'requests': len(samples),
+            'errors': sum(worker.errors.get(name, 0) for worker in workers),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            # how many of these one worker gets through per second
+            'throughput': round(len(samples) / sum(latencies), 1) if sum(latencies) else None,
+            'queries': round(sum(queries) / len(queries), 2) if queries else None,
+        }
+    total = sum(entry['requests'] for entry in report.values())
+    report['total'] = {'requests': total, 'seconds': round(wall_seconds, 2), 'throughput': round(total / wall_seconds, 1)}
+    return report
+
+def print_report(report):
+    print(f'{"route":<16} {"requests":>8} {"errors":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"req/s":>8} {"queries":>8}')
+    for name, entry in report.items():
+        if name == 'total':
+            continue
+        print(f'{name:<16} {entry["requests"]:>8} {entry["errors"]:>6} {entry["p50_ms"]:>8} {entry["p95_ms"]:>8} {entry["p99_ms"]:>8} '
+              f'{entry["throughput"] if entry["throughput"] is not None else "-":>8} {entry["queries"] if entry["queries"] is not None else "-":>8}')
+    total = report['total']
+    print(f'{total["requests"]} requests in {total["seconds"]}s, {total["throughput"]} req/s overall')
+
+def compare(report, baseline, tolerance):
+    """ Regressions against a baseline report: more queries per request, or latency more than tolerance higher. Latency is
+    judged on the median, and on p95 too once both runs have 100 requests of the route (below that p95 is a single outlier). """
+    regressions = []
+    for name, base in baseline['routes'].items():
+        entry = report.get(name)
+        if not entry:
+            continue
+        if base.get('queries') is not None and entry['queries'] is not None and entry['queries'] > base['queries']:
+            regressions.append(f'{name}: {entry["queries"]} queries per request, baseline {base["queries"]}')
+        if entry['p50_ms'] > base['p50_ms'] * (1 + tolerance):
+            regressions.append(f'{name}: p50 {entry["p50_ms"]}ms, baseline {base["p50_ms"]}ms (+{tolerance:.0%} allowed)')
+        if min(entry['requests'], base['requests']) >= 100 and entry['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f'{name}: p95 {entry["p95_ms"]}ms, baseline {base["p95_ms"]}ms (+{tolerance:.0%} allowed)')
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Seeds a database and benchmarks the SimpleStore routes.')
+    parser.add_argument('--users', type=int, default=20, help='users to seed')
+    parser.add_argument('--products', type=int, default=10, help='products seeded per user')
+    parser.add_argument('--cart-rows', type=int, default=5, help='cart rows seeded per user')
+    parser.add_argument('--iterations', type=int, default=10, help='times each worker goes through every route')
+    parser.add_argument('--concurrency', type=int, default=1, help='workers (threads) running at once')
+    parser.add_argument('--url', help='benchmark a running server instead of the test client')
+    parser.add_argument('--no-cache', action='store_true', help='run with CACHE_TYPE=null')
+    parser.add_argument('--seed', type=int, default=1, help='random seed, for the same requests every run')
+    parser.add_argument('--json', help='also write the report to this file')
+    parser.add_argument('--save-baseline', help='write the report as the baseline to this file')
+    parser.add_argument('--compare', help='baseline file to compare against, exits 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='latency increase allowed over the baseline (0.5 = +50%%)')
+    args = parser.parse_args(argv)
+    random.seed(args.seed)
+
+    if not os.environ.get('DATABASE_URL'):
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='simplestore-bench-'), 'bench.sqlite')
+    from app import create_app
+    from extensions import db
+    # every worker signs in on each iteration, from the same address
+    config = {'SQLALCHEMY_DATABASE_URI': os.environ['DATABASE_URL'], 'SIGNIN_ATTEMPTS': 10 ** 9}
+    if args.no_cache:
+        config['CACHE_TYPE'] = 'null'
+    app = create_app(config)
+
+    usernames, product_ids = seed(app, max(args.users, args.concurrency), args.products, args.cart_rows)
+    per_page = app.config['PRODUCTS_PER_PAGE']
+    second_page = sorted(product_ids)[-per_page] if len(product_ids) > per_page else 0
+    counter = None
+    if args.url:
+        drivers = [HttpDriver(args.url) for _ in range(args.concurrency)]
+    else:
+        with app.app_context():
+            counter = QueryCounter([db.engine] + list(getattr(app.extensions.get('replicas'), 'engines', [])))
+        drivers = [TestClientDriver(app) for _ in range(args.concurrency)]
+    workers = [Worker(i, driver, usernames[i], product_ids, second_page) for i, driver in enumerate(drivers)]
+
+    threads = [threading.Thread(target=run_worker, args=(worker, args.iterations, counter)) for worker in workers]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report = summarize(workers, time.perf_counter() - start)
+    print_report(report)
+
+    settings = {name: getattr(args, name) for name in ('users', 'products', 'cart_rows', 'iterations', 'concurrency', 'no_cache', 'seed')}
+    settings['database'] = args.url or make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_backend_name()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': settings, 'routes': report}, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'settings': settings, 'routes': {name: entry for name, entry in report.items() if name != 'total'}}, f, indent=2)
+        print(f'Saved the baseline to {args.save_baseline}')
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('settings') != settings:
+            print(f'Note: the baseline was made with other settings ({baseline.get("settings")})')
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            return 1
+        print('No regressions against the baseline.')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+from io import BytesIO
+
+# Cold start benchmark: how long a fresh interpreter takes to import the app module, to have a ready app (what every
+# gunicorn worker pays without preload_app) and to answer its first request. Each stage runs in new processes, so
+# nothing is already imported. With --rev the same stages are timed on an older commit for comparison:
+#
+#   python bench_startup.py
+#   python bench_startup.py --rev HEAD~1 --runs 20
+#   python bench_startup.py --modules 15              # also list the slowest imports (python -X importtime)
+
+STAGES = ('import app', 'app ready', 'first request')
+
+CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+{code}
+sys.stdout.write('\\n' + json.dumps(time.perf_counter() - started) + '\\n')
+'''
+
+def stage_code(tree, stage):
+    """ Python code for a stage in a tree. Trees from before create_app build the app when app is imported. """
+    factory = os.path.exists(os.path.join(tree, 'wsgi.py'))
+    if stage == 'import app':
+        return 'import app'
+    ready = 'from wsgi import app' if factory else 'from app import app'
+    if stage == 'app ready':
+        return ready
+    return f'{ready}\napp.test_client().get("/")'
+
+def time_stage(tree, code, env):
+    """ Seconds the code took in a new interpreter (its startup left out). """
+    result = subprocess.run([sys.executable, '-c', CHILD.format(code=code)], cwd=tree, env=env, capture_output=True, text=True)
+    if result.returncode:
+        raise SystemExit(f'Failed in {tree}:\n{result.stderr}')
+    return float(result.stdout.strip().rsplit('\n', 1)[-1])
+
+def measure(trees, runs, env):
+    """ {tree name: {stage: [seconds, ...]}} of runs runs of every stage, the trees take turns so drift hits them alike. """
+    timings = {name: {stage: [] for stage in STAGES} for name in trees}
+    for _ in range(runs):
+        for name, tree in trees.items():
+            for stage in STAGES:
+                timings[name][stage].append(time_stage(tree, stage_code(tree, stage), env))
+    return timings
+
+def slowest_imports(tree, count, env):
+    """ (cumulative microseconds, package) of the count slowest packages the ready app imports, the apps own modules left out. """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', stage_code(tree, 'app ready')], cwd=tree, env=env, capture_output=True, text=True)
+    own = {name[:-len('.py')] for name in os.listdir(tree) if name.endswith('.py')}
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        if package not in own:
+            packages[package] = max(packages.get(package, 0), int(cumulative))
+    return sorted(((cumulative, package) for package, cumulative in packages.items()), reverse=True)[:count]
+
+def checkout(rev, directory):
+    """ Extracts the tree of a commit into directory. """
+    archive = subprocess.run(['git', 'archive', rev], capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=BytesIO(archive)) as tar:
+        tar.extractall(directory)
+    return directory
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Times the cold start of the app in fresh interpreters.')
+    parser.add_argument('--runs', type=int, default=10, help='processes started per stage')
+    parser.add_argument('--rev', help='also time this commit (git rev) for comparison')
+    parser.add_argument('--modules', type=int, default=0, help='list this many of the slowest imports')
+    parser.add_argument('--json', help='also write the timings to this file')
+    args = parser.parse_args(argv)
+
+    # nothing here connects, the database only has to be configured. A fixed key keeps instance/secret_key out of it.
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='simplestore-startup-'), 'startup.sqlite'))
+    env.setdefault('SECRET_KEY', 'bench-startup')
+
+    trees = {'current': os.path.dirname(os.path.abspath(__file__))}
+    if args.rev:
+        trees[args.rev] = checkout(args.rev, tempfile.mkdtemp(prefix='simplestore-rev-'))
+    timings = measure(trees, args.runs, env)
+
+    print(f'{"stage":<16}' + ''.join(f'{name:>22}' for name in timings))
+    for stage in STAGES:
+        cells = [f'{statistics.median(timings[name][stage]) * 1000:8.1f}ms (min {min(timings[name][stage]) * 1000:5.0f})' for name in timings]
+        print(f'{stage:<16}' + ''.join(f'{cell:>22}' for cell in cells))
+    if args.rev:
+        before, after = statistics.median(timings[args.rev]['app ready']), statistics.median(timings['current']['app ready'])
+        print(f'\napp ready: {before * 1000:.1f}ms -> {after * 1000:.1f}ms ({(after - before) / before:+.0%})')
+    for name, tree in trees.items():
+        if args.modules:
+            print(f'\nslowest imports ({name}):')
+            for cumulative, module in slowest_imports(tree, args.modules, env):
+                print(f'  {cumulative / 1000:8.1f}ms  {module}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({name: {stage: {'median': statistics.median(seconds), 'min': min(seconds)} for stage, seconds in stages.items()}
+                       for name, stages in timings.items()}, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
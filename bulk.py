@@ -0,0 +1,157 @@
+import csv
+import io
+import json
+from sqlalchemy import insert
+from helpers import normalize_name
+
+# Bulk import and export of a sellers products. Imports read the file as a stream (csv or json lines), check rows in
+# batches of batch_size, look duplicates up with one indexed query per batch and insert each batch with a single
+# executemany INSERT in its own transaction, so a big catalog never sits in memory or in one huge transaction.
+# Exports page through the products by id and write them out as they are read.
+
+COLUMNS = ('name', 'description', 'price', 'total_stock', 'image_link')
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+class BulkError(Exception):
+    """ Raised when an import file cannot be read at all (unknown format, missing columns). """
+
+def import_format(filename, requested=None):
+    """ Format of an import file, from the requested one or the files extension. """
+    found = requested or (filename or '').rsplit('.', 1)[-1].lower()
+    if found == 'json':
+        found = 'jsonl'
+    if found not in FORMATS:
+        raise BulkError(f'Unknown import format {found!r}, send a .csv or .jsonl file.')
+    return found
+
+def read_rows(stream, format):
+    """ Yields (line number, row dict) from a binary stream of csv or json lines. """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if format == 'csv':
+        reader = csv.DictReader(text)
+        missing = [column for column in COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            raise BulkError(f'Missing columns: {", ".join(missing)}')
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, e
+            continue
+        yield line_number, row
+
+def check_row(row):
+    """ The products columns from an import row, or raises ValueError saying what is wrong with it. """
+    if isinstance(row, Exception):
+        raise ValueError(f'Not json: {row}')
+    if not isinstance(row, dict):
+        raise ValueError('Each line has to be an object')
+    values = {}
+    for column in ('name', 'description', 'image_link'):
+        value = str(row.get(column) or '').strip()
+        if not value:
+            raise ValueError(f'Missing {column}')
+        values[column] = value
+    try:
+        values['price'] = float(row.get('price'))
+        values['total_stock'] = int(row.get('total_stock'))
+    except (TypeError, ValueError):
+        raise ValueError('price has to be a number and total_stock a whole number')
+    if values['price'] < 0 or values['total_stock'] < 0:
+        raise ValueError('price and total_stock cannot be negative')
+    return values
+
+def import_products(db, Product, userid, rows, batch_size=1000, max_errors=100, on_insert=None):
+    """ Adds the products in rows ((line number, row) pairs) to a sellers catalog, skipping names the seller already has.
+    Each batch is its own transaction, on_insert([(id, image_link), ...]) runs in it before the commit (to queue follow up
+    work with the products). Yields the report so far after every batch, the last one is the final report:
+    {'processed', 'imported', 'duplicates', 'invalid', 'failed', 'errors': [{'line', 'message'}, ...] (the first max_errors)} """
+    report = {'processed': 0, 'imported': 0, 'duplicates': 0, 'invalid': 0, 'failed': 0, 'errors': []}
+    # names added by this import, so a name repeated in the file is a duplicate too
+    seen = set()
+    batch = []
+    for line_number, row in rows:
+        batch.append((line_number, row))
+        if len(batch) >= batch_size:
+            _report_errors(report, _import_batch(db, Product, userid, batch, seen, report, on_insert), max_errors)
+            batch = []
+            yield report
+    if batch or not report['processed']:
+        _report_errors(report, _import_batch(db, Product, userid, batch, seen, report, on_insert), max_errors)
+        yield report
+
+def _import_batch(db, Product, userid, batch, seen, report, on_insert):
+    """ Checks and inserts one batch, counting into report. Returns the batches errors as (line number, message) pairs. """
+    errors = []
+    checked = []
+    for line_number, row in batch:
+        report['processed'] += 1
+        try:
+            checked.append((line_number, check_row(row)))
+        except ValueError as e:
+            report['invalid'] += 1
+            errors.append((line_number, str(e)))
+    # one query on the unique (userid, normalized_name) index for the whole batch
+    names = {normalize_name(values['name']) for _, values in checked}
+    existing = {name for (name,) in db.session.query(Product.normalized_name).filter((Product.userid == userid) & (Product.normalized_name.in_(names)))} if names else set()
+    new_rows = []
+    for line_number, values in checked:
+        normalized = normalize_name(values['name'])
+        if normalized in existing or normalized in seen:
+            report['duplicates'] += 1
+            errors.append((line_number, f'A product named "{values["name"]}" already exists'))
+            continue
+        seen.add(normalized)
+        new_rows.append(dict(values, normalized_name=normalized, userid=userid))
+    if not new_rows:
+        return errors
+    try:
+        # a single executemany INSERT (batched VALUES on postgres and sqlite), the ids come back for the image jobs
+        inserted = db.session.execute(insert(Product).returning(Product.id, Product.image_link, sort_by_parameter_order=True), new_rows).all()
+        if on_insert:
+            on_insert(inserted)
+        db.session.commit()
+        report['imported'] += len(inserted)
+    except Exception as e:
+        # a product added meanwhile (another import, a tab) fails the unique index and with it the batch
+        print(e)
+        db.session.rollback()
+        report['failed'] += len(new_rows)
+        errors.append((batch[0][0], f'Could not save lines {batch[0][0]} to {batch[-1][0]}: {e.__class__.__name__}'))
+    return errors
+
+def _report_errors(report, errors, max_errors):
+    # a batch is checked in passes (values, then names), its errors are reported in line order like the batches are
+    for line_number, message in sorted(errors, key=lambda error: error[0]):
+        if len(report['errors']) < max_errors:
+            report['errors'].append({'line': line_number, 'message': message})
+
+def export_products(db, Product, userid, format, batch_size=1000):
+    """ Yields a sellers products as csv or json lines, batch_size rows at a time (keyset pages on Product.id). """
+    columns = ('id',) + COLUMNS
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if format == 'csv':
+        writer.writerow(columns)
+    after = 0
+    while True:
+        rows = (db.session.query(*[getattr(Product, column) for column in columns])
+                .filter((Product.userid == userid) & (Product.id > after)).order_by(Product.id).limit(batch_size).all())
+        if not rows:
+            break
+        for row in rows:
+            if format == 'csv':
+                writer.writerow(row)
+            else:
+                buffer.write(json.dumps(dict(zip(columns, row))) + '\n')
+        after = rows[-1].id
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.getvalue():
+        yield buffer.getvalue()
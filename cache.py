@@ -0,0 +1,166 @@
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict
+
+# Values are kept as json so the same entries work in process and in redis (product dicts, lists of them, ids).
+# Whole groups of keys (every catalog page, every search) are invalidated by bumping a generation number that is part
+# of their keys, single keys (one product) are deleted directly. Old generations simply age out of the LRU / TTL.
+
+#------------
+# Backends
+#------------
+class LRUBackend:
+    """ In process backend, a bounded OrderedDict with a ttl per entry. Not shared between workers. """
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # generation counters live outside the lru so they are never evicted before the entries using them:
+        # {key: (generation, bumped at)}. Generations come from one sequence and are never reused
+        self._counters = {}
+        self._generations = itertools.count(1)
+        # a counter left alone for longer than any entry lives is forgotten (see _prune_counters), None once an entry
+        # without a ttl was stored
+        self._longest_ttl = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._counters:
+                return str(self._counters[key][0])
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            if not ttl:
+                self._longest_ttl = None
+            elif self._longest_ttl is not None:
+                self._longest_ttl = max(self._longest_ttl, ttl)
+            self._entries[key] = (value, time.monotonic() + ttl if ttl else None)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            generation = next(self._generations)
+            self._counters[key] = (generation, time.monotonic())
+            if len(self._counters) > self.max_entries:
+                self._prune_counters()
+            return generation
+
+    def _prune_counters(self):
+        # every entry written under an older generation of a namespace (or before its first one) has expired once its
+        # counter was last bumped longer than the longest ttl ago, so the namespace can start over from no counter
+        if self._longest_ttl is None:
+            return
+        idle_since = time.monotonic() - self._longest_ttl
+        self._counters = {key: counter for key, counter in self._counters.items() if counter[1] >= idle_since}
+
+class RedisBackend:
+    """ Shared backend for every worker. Takes any redis-py compatible client. """
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url):
+        # optional dependency, only needed when CACHE_TYPE = 'redis'
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        value = self.client.get(key)
+        return value.decode() if isinstance(value, bytes) else value
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+class NullBackend:
+    """ Caches nothing, every lookup is a miss. """
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def incr(self, key):
+        return 0
+
+#------------
+# Cache
+#------------
+class Cache:
+    def __init__(self, backend, prefix='simplestore', default_ttl=60):
+        self.backend = backend
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+        # {namespace family: {'hits': n, 'misses': n}}, 'seller:12' counts as 'seller' so there is one entry per family
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+    def key(self, namespace, *parts):
+        """ Key of an entry in a namespace, including the namespaces current generation. """
+        generation = self.backend.get(self._generation_key(namespace)) or '0'
+        return ':'.join([self.prefix, namespace, str(generation)] + [str(part) for part in parts])
+
+    def get_or_set(self, namespace, parts, loader, ttl=None):
+        """ Cached value for (namespace, *parts), calling loader() and storing its (json-able) result on a miss. None is never stored. """
+        key = self.key(namespace, *parts)
+        value = self.backend.get(key)
+        if value is not None:
+            self._count(namespace, 'hits')
+            return json.loads(value)
+        self._count(namespace, 'misses')
+        value = loader()
+        if value is not None:
+            self.backend.set(key, json.dumps(value), ttl or self.default_ttl)
+        return value
+
+    def delete(self, namespace, *parts):
+        self.backend.delete(self.key(namespace, *parts))
+
+    def invalidate(self, *namespaces):
+        """ Drops every entry of the given namespaces at once. """
+        for namespace in namespaces:
+            self.backend.incr(self._generation_key(namespace))
+
+    def _generation_key(self, namespace):
+        return f'{self.prefix}:generation:{namespace}'
+
+    def _count(self, namespace, outcome):
+        with self._stats_lock:
+            counts = self.stats.setdefault(namespace.split(':')[0], {'hits': 0, 'misses': 0})
+            counts[outcome] += 1
+
+def cache_from_config(config):
+    """ Builds the cache described by CACHE_TYPE ('lru', 'redis' or 'null'). """
+    cache_type = config.get('CACHE_TYPE', 'lru')
+    if cache_type == 'redis':
+        backend = RedisBackend.from_url(config['CACHE_REDIS_URL'])
+    elif cache_type == 'null':
+        backend = NullBackend()
+    else:
+        backend = LRUBackend(config.get('CACHE_MAX_ENTRIES', 1024))
+    return Cache(backend, config.get('CACHE_KEY_PREFIX', 'simplestore'), config.get('CACHE_DEFAULT_TTL', 60))
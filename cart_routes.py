@@ -0,0 +1,303 @@
+from datetime import datetime
+from uuid import uuid4
+from flask import Blueprint, current_app, render_template, session, flash, request, redirect, jsonify, g, has_request_context
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import Product, CartLine, Cart, StockReservation, Order, OrderLine, Job
+from helpers import logged_in, current_user, cart_count, etag_for, conditional_response, stream_page
+from store import products_in_cart, stock_changed, cart_changed
+from stock import take_stock, give_back_stock, reserve_stock, release_stock, shrink_stock, consume_stock, release_expired_stock
+from jobs import enqueue
+from listings import cart_rows
+from assets import static_version
+
+# The cart (single and batched changes, the streamed cart page) and turning it into orders.
+bp = Blueprint('cart', __name__)
+
+#-----
+# Cart Routes
+#-----
+# the cart count in the header of every page, counted by the query that loaded the user (load_user)
+# (jobs render templates too, outside of any request)
+@bp.app_context_processor
+def inject_cart_amount():
+    if not has_request_context():
+        return {}
+    return {'cart_amount': cart_count()}
+
+# api route (make ajax fetch request and or XMLHTTP)
+@bp.route('/cart/amount')
+@logged_in
+def get_cart_amount():
+    try:
+        # counted by the same query that loaded the user (load_user)
+        return jsonify({'amount': g.cart_amount})
+    except Exception as e:
+        print(e)
+        flash('A problem occurred when attempting to get your cart amount', 'error')
+        return redirect('/')
+def cart_operation(user, op, id_, quantity=1):
+    """ Applies one change to the users cart in the current transaction, returns (result, message).
+    op is 'add' (quantity more units), 'remove' (every unit) or 'quantity' (set the units to quantity, 0 removes). """
+    # the id comes from the client, anything but a positive 32 bit integer would be an error in the database (postgres)
+    # and undo the whole batch
+    try:
+        id_ = int(id_)
+    except (TypeError, ValueError):
+        id_ = None
+    row = db.session.query(Product, Product.listed().label('listed')).filter(Product.id == id_).first() if id_ and 0 < id_ < 2 ** 31 else None
+    if not row:
+        return False, 'Hmm...Product does not exist anymore.'
+    product, listed = row
+    if not isinstance(quantity, int) or quantity < 0:
+        return False, 'Quantity has to be a positive number.'
+    current = db.session.query(CartLine.quantity).filter_by(cart_id=user.cart.id, product_id=product.id).scalar() or 0
+    if op == 'add':
+        target = current + quantity
+    elif op == 'remove':
+        if not current:
+            return False, f'Product "{product.name}" is not in your cart.'
+        target = 0
+    elif op == 'quantity':
+        target = quantity
+    else:
+        return False, f'Unknown cart operation "{op}".'
+
+    minutes = current_app.config['STOCK_RESERVATION_MINUTES']
+    if target > current:
+        # a soft deleted sellers products can still be taken out of a cart, but no more of them put in
+        if not listed:
+            return False, f'Product "{product.name}" is no longer sold.'
+        # the stock is taken by one conditional UPDATE, so two users can never both get the last one
+        if not reserve_stock(db, Product, StockReservation, product.id, user.id, target - current, minutes):
+            # carts that were left alone may still be holding some, give that back and try once more
+            release_expired_stock(db, Product, StockReservation)
+            if not reserve_stock(db, Product, StockReservation, product.id, user.id, target - current, minutes):
+                return False, f'Product "{product.name}" is out of STOCK!'
+        add_to_cart(user.cart, product.id, target - current)
+    elif target < current:
+        # we do not want to remove the product itself, because other users rely on it too. So instead, we shrink (or delete) its line in cart_products.
+        line = db.session.query(CartLine).filter_by(cart_id=user.cart.id, product_id=product.id)
+        if target == 0:
+            line.delete(synchronize_session=False)
+        else:
+            line.update({CartLine.quantity: CartLine.quantity - (current - target)}, synchronize_session=False)
+        # the stock held for those units goes back to the product
+        shrink_stock(db, Product, StockReservation, user.id, product.id, current - target, minutes)
+    touch_cart(user.cart)
+    return True, None
+
+def cart_submission(op):
+    """ Shared body of the single operation cart routes, the json body is {"id": product id}. """
+    id_ = (request.get_json(silent=True) or {}).get('id')
+    user = current_user()
+    try:
+        result, message = cart_operation(user, op, id_)
+        if not result:
+            db.session.rollback()
+            return jsonify({'result': False, 'message': message})
+        db.session.commit()
+        # its stock changed (listings pick it up when their short ttl runs out, open pages right away)
+        stock_changed([int(id_)])
+        amount = cart_amount(user.cart)
+        cart_changed(user.id, amount)
+        return jsonify({'result': True, 'amount': amount})
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        return jsonify({'result': False})
+
+@bp.route('/cart/add', methods=["POST"])
+@logged_in
+def cart_add_submission():
+    return cart_submission('add')
+@bp.route('/cart/remove', methods=['POST'])
+@logged_in
+def cart_remove_submission():
+    return cart_submission('remove')
+
+@bp.route('/cart/batch', methods=['POST'])
+@logged_in
+def cart_batch_submission():
+    """ Applies a list of cart operations in one transaction.
+    Takes {"operations": [{"op": "add" | "remove" | "quantity", "id": product id, "quantity": n}, ...]} and answers with a result per operation.
+    An operation that cannot be done (out of stock, unknown product) is skipped without undoing the others. """
+    operations = (request.get_json(silent=True) or {}).get('operations')
+    if not isinstance(operations, list) or not operations or len(operations) > current_app.config['CART_BATCH_LIMIT']:
+        return jsonify({'result': False, 'message': f'Send between 1 and {current_app.config["CART_BATCH_LIMIT"]} operations.'})
+    user = current_user()
+    results = []
+    changed = set()
+    try:
+        for operation in operations:
+            if not isinstance(operation, dict):
+                results.append({'result': False, 'message': 'Operations have to be objects.'})
+                continue
+            result, message = cart_operation(user, operation.get('op'), operation.get('id'), operation.get('quantity', 1))
+            results.append({'id': operation.get('id'), 'result': result, 'message': message})
+            if result:
+                changed.add(int(operation['id']))
+        db.session.commit()
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        return jsonify({'result': False})
+    stock_changed(changed)
+    amount = cart_amount(user.cart)
+    cart_changed(user.id, amount)
+    return jsonify({'result': True, 'results': results, 'amount': amount})
+
+def touch_cart(cart):
+    """ Marks a cart as changed (Cart.updated_at), so cached copies of the cart page are not reused. """
+    db.session.query(Cart).filter_by(id=cart.id).update({Cart.updated_at: datetime.utcnow()}, synchronize_session=False)
+
+def cart_amount(cart):
+    """ Number of units in a cart, counted by one aggregate query. """
+    return db.session.query(db.func.coalesce(db.func.sum(CartLine.quantity), 0)).filter(CartLine.cart_id == cart.id).scalar()
+
+def add_to_cart(cart, product_id, quantity):
+    """ Adds quantity units of a product to a cart, bumping the existing line in place when there is one. """
+    bumped = db.session.query(CartLine).filter_by(cart_id=cart.id, product_id=product_id).update({CartLine.quantity: CartLine.quantity + quantity}, synchronize_session=False)
+    if not bumped:
+        db.session.add(CartLine(cart_id=cart.id, product_id=product_id, quantity=quantity))
+
+
+@bp.route('/cart/exist', methods=['POST'])
+@logged_in
+def exist_in_cart_batch():
+    """ Takes {"ids": [...]} and answers with the ids that are already in the users cart. """
+    data = request.get_json(silent=True) or {}
+    try:
+        ids = [int(id_) for id_ in data.get('ids', [])]
+    except (TypeError, ValueError):
+        return jsonify({'result': False, 'in_cart': []})
+    return jsonify({'result': True, 'in_cart': sorted(products_in_cart(ids))})
+
+@bp.route('/cart/<int:product_id>/exist')
+@logged_in
+def exist_in_cart(product_id):
+    return jsonify({'result': product_id in products_in_cart([product_id])})
+
+@bp.route("/cart/clear")
+@logged_in
+def clear_cart():
+    try:
+        user = current_user()
+        # one bulk DELETE for every line in the cart
+        db.session.query(CartLine).filter_by(cart_id=user.cart.id).delete(synchronize_session=False)
+        touch_cart(user.cart)
+        released = release_stock(db, Product, StockReservation, user.id)
+        db.session.commit()
+        stock_changed(released)
+        # from the session, user was expired by the commit
+        cart_changed(session['userid'], 0)
+        flash('Cleared your cart', 'success')
+        return redirect('/')
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        flash('Could not clear your cart', 'error')
+        return redirect('/cart')
+
+@bp.route('/cart')
+@logged_in
+def cart():
+    user = current_user()
+    # validated before loading the lines: the cart changes with touch_cart, its products with their updated_at
+    count, products_updated_at = (db.session.query(db.func.count(CartLine.product_id), db.func.max(Product.updated_at))
+                                  .join(Product, Product.id == CartLine.product_id).filter(CartLine.cart_id == user.cart.id).one())
+    last_modified = max(filter(None, [user.cart.updated_at, products_updated_at]), default=None)
+    etag = etag_for('cart', user.id, user.cart.updated_at, count, products_updated_at, cart_count(), static_version(current_app.static_folder, current_app.config['ASSETS_BUILD_DIR']))
+    def render():
+        quantities = {}
+        # a new key every time the cart is rendered (a 304 keeps the one the browser has), so submitting this page twice places one order
+        return stream_page('/pages/cart.html', products=cart_rows(db, Product, CartLine, user.cart.id, quantities, current_app.config['STREAM_YIELD_PER']), quantities=quantities, product_count=count,
+                           idempotency_key=uuid4().hex, userid=session.get('userid'))
+    return conditional_response(etag, render, last_modified)
+
+#----------
+# Order Routes
+#----------
+@bp.route('/checkout', methods=['POST'])
+@logged_in
+def checkout():
+    """ Turns the cart into an order in one transaction, the slow follow up work is queued for the worker. """
+    user = current_user()
+    key = request.form.get('idempotency_key') or request.headers.get('Idempotency-Key')
+    if key:
+        existing = db.session.query(Order).filter_by(user_id=user.id, idempotency_key=key).first()
+        if existing:
+            flash('That order was already placed.', 'info')
+            return redirect(f'/orders/{existing.id}')
+
+    lines = db.session.query(CartLine).options(db.joinedload(CartLine.product)).filter_by(cart_id=user.cart.id).all()
+    if not lines:
+        flash('You do not have any products in your cart currently', 'info')
+        return redirect('/cart')
+    try:
+        # the stock the cart holds becomes the sale, anything no longer held (expired reservation) is taken now
+        held = consume_stock(db, StockReservation, user.id)
+        # the seller may have deleted their account since the product was put in the cart
+        unlisted = {product_id for (product_id,) in db.session.query(Product.id).filter(Product.id.in_([line.product_id for line in lines]) & ~Product.listed())}
+        for line in lines:
+            if line.product_id in unlisted:
+                db.session.rollback()
+                flash(f'Sorry, {line.product.name} is no longer sold, remove it from your cart to check out.', 'error')
+                return redirect('/cart')
+            missing = line.quantity - held.pop(line.product_id, 0)
+            if missing > 0 and not take_stock(db, Product, line.product_id, missing):
+                db.session.rollback()
+                flash(f'Sorry, could not finish transaction currently out of stock in {line.product.name}.', 'error')
+                return redirect('/cart')
+            if missing < 0:
+                give_back_stock(db, Product, line.product_id, -missing)
+        # reservations for products that already left the cart
+        for product_id, units in held.items():
+            give_back_stock(db, Product, product_id, units)
+
+        order = Order(user_id=user.id, idempotency_key=key, status='placed', total=sum(line.product.price * line.quantity for line in lines), created_at=datetime.utcnow())
+        order.lines = [OrderLine(product_id=line.product_id, seller_id=line.product.userid, name=line.product.name, price=line.product.price, quantity=line.quantity) for line in lines]
+        db.session.add(order)
+        product_ids = [line.product_id for line in lines]
+        db.session.query(CartLine).filter_by(cart_id=user.cart.id).delete(synchronize_session=False)
+        touch_cart(user.cart)
+        db.session.flush()
+        # queued in this same transaction, so the jobs exist exactly when the order does
+        for kind in ('render_order_confirmation', 'notify_sellers', 'reconcile_stock'):
+            enqueue(db, Job, kind, {'order_id': order.id}, key=f'{kind}:{order.id}', max_attempts=current_app.config['JOB_MAX_ATTEMPTS'])
+        db.session.commit()
+    except IntegrityError as e:
+        # the same idempotency key was used by a checkout that committed first
+        print(e)
+        db.session.rollback()
+        existing = db.session.query(Order).filter_by(user_id=user.id, idempotency_key=key).first()
+        if existing:
+            return redirect(f'/orders/{existing.id}')
+        flash('Could not place your order. Try again.', 'error')
+        return redirect('/cart')
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        flash('Could not place your order. Try again.', 'error')
+        return redirect('/cart')
+
+    # the products sold, and those whose hold was given back having left the cart before
+    stock_changed(set(product_ids) | set(held))
+    cart_changed(session['userid'], 0)
+    flash('Your order was placed!', 'success')
+    return redirect(f'/orders/{order.id}')
+
+@bp.route('/orders')
+@logged_in
+def orders():
+    user_orders = db.session.query(Order).filter_by(user_id=session.get('userid')).order_by(Order.id.desc()).all()
+    return render_template('/pages/orders.html', orders=user_orders, userid=session.get('userid'))
+
+@bp.route('/orders/<int:order_id>')
+@logged_in
+def order_info(order_id):
+    order = db.session.query(Order).options(db.selectinload(Order.lines)).filter_by(id=order_id, user_id=session.get('userid')).first()
+    if not order:
+        flash('Hmm...Could not find that order.', 'info')
+        return redirect('/orders')
+    return render_template('/pages/order.html', order=order, userid=session.get('userid'))
@@ -0,0 +1,92 @@
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from extensions import db
+from models import User, Product, CartLine, StockReservation, Job, load_user_query
+from helpers import explain_uses_index
+from store import run_import, stock_changed
+from stock import release_expired_stock
+from jobs import work
+from listings import product_columns
+from bulk import BulkError, import_format, read_rows
+from assets import build_assets, brotli
+
+#-----------
+# CLI commands
+#-----------
+@click.command('explain-queries')
+@with_appcontext
+def explain_queries():
+    """ Runs EXPLAIN on the lookups every route relies on and fails if any of them cannot use an index. """
+    hot_queries = {
+        'username_exists': db.session.query(User).filter_by(username='username'),
+        'index': db.session.query(*product_columns(Product)).filter(Product.id > 0).order_by(Product.id).limit(25),
+        'getProducts': db.session.query(*product_columns(Product)).filter_by(userid=1).order_by(Product.id).limit(25),
+        'new_product_submission': db.session.query(Product.id).filter((Product.userid == 1) & (Product.normalized_name == 'name')),
+        'get_product_info': db.session.query(*product_columns(Product)).filter_by(id=1),
+        'load_user': load_user_query(1),
+        'cart_amount': db.session.query(db.func.coalesce(db.func.sum(CartLine.quantity), 0)).filter(CartLine.cart_id == 1),
+        'cart products': db.session.query(*product_columns(Product), CartLine.quantity).join(CartLine, CartLine.product_id == Product.id).filter(CartLine.cart_id == 1),
+        'products_in_cart': db.session.query(CartLine.product_id).filter((CartLine.cart_id == 1) & (CartLine.product_id.in_([1, 2, 3]))),
+    }
+    failed = []
+    for name, query in hot_queries.items():
+        uses_index, plan = explain_uses_index(db, query)
+        print(f'{"ok  " if uses_index else "SCAN"} {name}')
+        if not uses_index:
+            print('\n'.join(f'       {line}' for line in plan))
+            failed.append(name)
+    if failed:
+        raise SystemExit(f'{len(failed)} queries do not use an index: {", ".join(failed)}')
+
+@click.command('worker')
+@with_appcontext
+@click.option('--once', is_flag=True, help='Run until the queue is empty instead of forever.')
+def worker_command(once):
+    """ Runs queued background jobs (order confirmations, seller notifications, stock reconciliation). """
+    processed = work(db, Job, once=once, poll_seconds=current_app.config['JOB_POLL_SECONDS'], timeout=current_app.config['JOB_TIMEOUT_SECONDS'])
+    print(f'Ran {processed} jobs')
+
+@click.command('import-products')
+@with_appcontext
+@click.argument('username')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'format_', type=click.Choice(['csv', 'jsonl']), help='Defaults to the files extension.')
+def import_products_command(username, path, format_):
+    """ Imports a csv / json lines file of products into a sellers catalog, printing progress after every batch. """
+    user = db.session.query(User).filter_by(username=username).first()
+    if not user:
+        raise click.ClickException(f'No user named {username}')
+    try:
+        with open(path, 'rb') as f:
+            for report in run_import(user.id, read_rows(f, import_format(path, format_))):
+                print(f'{report["processed"]} rows: {report["imported"]} imported, {report["duplicates"]} duplicates, {report["invalid"]} invalid, {report["failed"]} failed')
+    except BulkError as e:
+        raise click.ClickException(str(e))
+    for error in report['errors']:
+        print(f'line {error["line"]}: {error["message"]}')
+
+@click.command('release-expired-stock')
+@with_appcontext
+def release_expired_stock_command():
+    """ Gives back the stock held by cart reservations that expired. Meant to be run every few minutes (cron). """
+    released = release_expired_stock(db, Product, StockReservation)
+    db.session.commit()
+    stock_changed(released)
+    print(f'Released {sum(released.values())} reserved units')
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    """ Bundles and minifies ASSET_BUNDLES into ASSETS_BUILD_DIR under fingerprinted names, with gzip and brotli copies. Run it on every deploy. """
+    report = build_assets(current_app.static_folder, current_app.config['ASSETS_BUILD_DIR'], current_app.config['ASSET_BUNDLES'])
+    for name, sizes in report.items():
+        br = f', {sizes["br"]} brotli' if sizes['br'] is not None else ''
+        print(f'{name} -> {sizes["file"]}: {sizes["source"]} bytes, {sizes["minified"]} minified, {sizes["gzip"]} gzip{br}')
+    if brotli is None:
+        print('brotli is not installed, only gzip copies were written')
+
+def init_commands(app):
+    """ Adds the commands above to the flask cli of app. """
+    for command in (explain_queries, worker_command, import_products_command, release_expired_stock_command, build_assets_command):
+        app.cli.add_command(command)
@@ -0,0 +1,89 @@
+import zlib
+from flask import request
+
+# brotli is optional, without it responses are gzipped
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Pages and json are compressed on their way out for clients that accept it. A streamed response stays streamed: each
+# chunk is compressed and flushed as it comes, so the browser still gets the top of the page while the rest renders.
+# Files from send_file (images, and built assets that have their own precompressed copies) are left as they are.
+
+class Compressor:
+    """ Incremental gzip or brotli compressor. """
+    def __init__(self, encoding, level=6, brotli_quality=4):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            # wbits 31: deflate with a gzip header and trailer
+            self._zlib = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data, flush=False):
+        """ Compressed data, flushed when asked so everything given so far can be sent right away. """
+        if self.encoding == 'br':
+            return self._brotli.process(data) + (self._brotli.flush() if flush else b'')
+        return self._zlib.compress(data) + (self._zlib.flush(zlib.Z_SYNC_FLUSH) if flush else b'')
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._brotli.finish()
+        return self._zlib.flush(zlib.Z_FINISH)
+
+def choose_encoding(accept_encodings):
+    """ 'br', 'gzip' or None, the best of what the client accepts and we can do. """
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+def compress_response(response, accept_encodings, config):
+    """ Compresses a response in place when its type is one of COMPRESS_MIMETYPES and it is worth it, returns it. """
+    if response.mimetype not in config.get('COMPRESS_MIMETYPES', ('text/html', 'application/json')):
+        return response
+    # caches must keep the compressed and the plain copy apart
+    response.vary.add('Accept-Encoding')
+    if (response.direct_passthrough or response.content_encoding or request.method == 'HEAD'
+            or response.status_code < 200 or response.status_code in (204, 304)):
+        return response
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None:
+        return response
+    compressor = Compressor(encoding, config.get('COMPRESS_LEVEL', 6), config.get('COMPRESS_BROTLI_QUALITY', 4))
+    if response.is_streamed:
+        response.response = _compressed_stream(response.response, compressor)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < config.get('COMPRESS_MIN_SIZE', 1024):
+            return response
+        response.set_data(compressor.compress(data) + compressor.finish())
+    response.content_encoding = encoding
+    # the compressed body is another representation of the same content, so its validator can only be a weak one
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+def _compressed_stream(pieces, compressor):
+    try:
+        for piece in pieces:
+            if isinstance(piece, str):
+                piece = piece.encode()
+            compressed = compressor.compress(piece, flush=True)
+            if compressed:
+                yield compressed
+        yield compressor.finish()
+    finally:
+        # the wrapped iterable (a stream_with_context generator) still has to be closed
+        if hasattr(pieces, 'close'):
+            pieces.close()
+
+def init_compression(app):
+    """ Compresses the responses of app for the clients that accept it. """
+    @app.after_request
+    def compress(response):
+        return compress_response(response, request.accept_encodings, app.config)
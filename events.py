@@ -0,0 +1,164 @@
+import json
+import queue
+import select
+import threading
+import time
+from sqlalchemy.engine import make_url
+
+# Live updates for open pages, sent as server-sent events by /events (see events_routes.py). Writes publish to a topic,
+# 'user:<id>' for a users cart count and 'product:<id>' for a products stock, and every page subscribed to the topic
+# gets the event. The hub is in process by default, so only pages connected to the worker that made the change hear
+# of it. With EVENTS_BACKEND = 'postgres' events go through LISTEN / NOTIFY and reach every worker, the job worker and
+# cli commands included.
+
+class Subscription:
+    """ The events one open page asked for, queued until its stream sends them. """
+    def __init__(self, hub, topics, all_products=False, max_queued=100):
+        self.hub = hub
+        self.topics = topics
+        self.all_products = all_products
+        # set when the page could not keep up and events were dropped, its stream ends and the browser reconnects
+        self.lagging = False
+        self._queue = queue.Queue(max_queued)
+
+    def wants(self, topic):
+        return topic in self.topics or (self.all_products and topic.startswith('product:'))
+
+    def put(self, event, data):
+        try:
+            self._queue.put_nowait((event, data))
+        except queue.Full:
+            self.lagging = True
+
+    def get(self, timeout):
+        """ (event, data), or None when nothing came within timeout seconds. """
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+class Hub:
+    """ In process pub/sub between the requests of one worker. """
+    def __init__(self, max_queued=100, max_subscriptions=None):
+        self.max_queued = max_queued
+        self.max_subscriptions = max_subscriptions
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id=None, product_ids=(), all_products=False):
+        """ Subscription to a users cart count and to the stock of product_ids (of every product with all_products).
+        None when max_subscriptions are open already. """
+        topics = {f'product:{product_id}' for product_id in product_ids}
+        if user_id is not None:
+            topics.add(f'user:{user_id}')
+        subscription = Subscription(self, topics, all_products, self.max_queued)
+        with self._lock:
+            if self.max_subscriptions is not None and len(self._subscriptions) >= self.max_subscriptions:
+                return None
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def listened(self, topics):
+        """ The topics some open page is subscribed to, so publishers can skip building events nobody gets. """
+        with self._lock:
+            return {topic for topic in topics if any(subscription.wants(topic) for subscription in self._subscriptions)}
+
+    def publish(self, topic, event, data):
+        self.deliver(topic, event, data)
+
+    def deliver(self, topic, event, data):
+        """ Hands an event to the subscriptions of this process that want it. """
+        with self._lock:
+            subscriptions = [subscription for subscription in self._subscriptions if subscription.wants(topic)]
+        for subscription in subscriptions:
+            subscription.put(event, data)
+
+class PostgresHub(Hub):
+    """ Hub shared through the database: publish sends a NOTIFY, a thread in each process LISTENs and delivers what arrives
+    to the subscriptions of that process. Needs psycopg2. """
+    def __init__(self, url, channel='simplestore_events', max_queued=100, max_subscriptions=None):
+        super().__init__(max_queued, max_subscriptions)
+        # a plain libpq url (no +driver part), for psycopg2 itself
+        self.url = make_url(url).set(drivername='postgresql').render_as_string(hide_password=False)
+        self.channel = channel
+        self._publisher = None
+        self._publish_lock = threading.Lock()
+        self._listener = None
+
+    def subscribe(self, user_id=None, product_ids=(), all_products=False):
+        self._start_listener()
+        return super().subscribe(user_id, product_ids, all_products)
+
+    def listened(self, topics):
+        # pages connected to other processes may be listening to any of them
+        return set(topics)
+
+    def publish(self, topic, event, data):
+        payload = json.dumps([topic, event, data])
+        with self._publish_lock:
+            try:
+                if self._publisher is None or self._publisher.closed:
+                    self._publisher = self._connect()
+                with self._publisher.cursor() as cursor:
+                    cursor.execute('SELECT pg_notify(%s, %s)', (self.channel, payload))
+            except Exception as e:
+                # a live update is not worth failing the request over, the page catches up on its next load
+                print(e)
+                self._publisher = None
+
+    def _start_listener(self):
+        # started on first use, so each (forked) worker process runs its own
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='events-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        while True:
+            connection = None
+            try:
+                connection = self._connect()
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.channel}')
+                while True:
+                    # wakes up now and then even when idle, so a dropped connection is noticed
+                    if select.select([connection], [], [], 30) == ([], [], []):
+                        connection.poll()
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        topic, event, data = json.loads(connection.notifies.pop(0).payload)
+                        self.deliver(topic, event, data)
+            except Exception as e:
+                print(e)
+                time.sleep(1)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def _connect(self):
+        # optional dependency, only needed for EVENTS_BACKEND = 'postgres'
+        import psycopg2
+        connection = psycopg2.connect(self.url)
+        connection.autocommit = True
+        return connection
+
+def hub_from_config(config):
+    """ Builds the hub described by EVENTS_BACKEND ('memory' or 'postgres'). """
+    max_queued, max_subscriptions = config.get('EVENTS_QUEUE_SIZE', 100), config.get('EVENTS_MAX_STREAMS')
+    if config.get('EVENTS_BACKEND', 'memory') == 'postgres':
+        if make_url(config['SQLALCHEMY_DATABASE_URI']).get_backend_name() != 'postgresql':
+            raise ValueError("EVENTS_BACKEND = 'postgres' needs a postgres SQLALCHEMY_DATABASE_URI")
+        return PostgresHub(config['SQLALCHEMY_DATABASE_URI'], config.get('EVENTS_CHANNEL', 'simplestore_events'), max_queued, max_subscriptions)
+    return Hub(max_queued, max_subscriptions)
+
+def format_event(event, data):
+    """ One server-sent event. """
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
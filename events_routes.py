@@ -0,0 +1,60 @@
+import time
+from flask import Blueprint, current_app, request, g, Response, make_response
+from extensions import db, hub
+from models import Product
+from helpers import current_user
+from events import format_event
+
+# Server-sent events keeping open pages up to date: the cart count in the header and the stock of the products shown.
+bp = Blueprint('events', __name__)
+
+@bp.route('/events')
+def events():
+    """ Event stream of a page: 'cart' events with the signed in users cart count and 'stock' events with the
+    total_stock of the products given in ?products=1,2,3. Starts with their current values, the page may be a cached copy. """
+    user = current_user()
+    # ids that are not numbers are skipped, the rest of the page still gets its updates
+    product_ids = sorted({int(id_) for id_ in request.args.get('products', '').split(',') if id_.isdigit()})
+    # a page showing a lot of products gets every stock change and picks its own. Such pages send ?products=all, their
+    # ids would not fit in the request line
+    all_products = request.args.get('products') == 'all' or len(product_ids) > current_app.config['EVENTS_MAX_PRODUCTS']
+    # subscribed before reading the current values, so no change falls in between
+    subscription = hub.subscribe(user.id if user else None, [] if all_products else product_ids, all_products)
+    if subscription is None:
+        # every stream this process serves is taken (each holds a worker thread), 204 tells the browser not to
+        # reconnect and the page keeps the values it was rendered with
+        return make_response('', 204)
+    initial = []
+    if user:
+        # counted by the same query that loaded the user (load_user)
+        initial.append(('cart', {'amount': g.cart_amount}))
+    if product_ids and not all_products:
+        for id_, total_stock in db.session.query(Product.id, Product.total_stock).filter(Product.id.in_(product_ids)):
+            initial.append(('stock', {'id': id_, 'total_stock': total_stock}))
+    # the stream stays open for minutes, it must not keep a database connection out of the pool meanwhile
+    db.session.close()
+
+    max_seconds = current_app.config['EVENTS_MAX_SECONDS']
+    keepalive_seconds = current_app.config['EVENTS_KEEPALIVE_SECONDS']
+    def stream():
+        # how long the browser waits before reconnecting, after the stream ends below or the connection drops
+        yield 'retry: 3000\n\n'
+        for event, data in initial:
+            yield format_event(event, data)
+        # ends now and then, so a worker thread is not tied to one page forever
+        deadline = time.monotonic() + max_seconds
+        while not subscription.lagging:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            message = subscription.get(min(keepalive_seconds, remaining))
+            # the comment line keeps proxies from closing an idle connection
+            yield format_event(*message) if message else ': keepalive\n\n'
+
+    response = Response(stream(), mimetype='text/event-stream')
+    # when the stream ends or the browser goes away, even before the stream started
+    response.call_on_close(subscription.close)
+    response.headers['Cache-Control'] = 'no-cache'
+    # tells nginx to pass the events on as they come instead of buffering them
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
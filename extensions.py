@@ -0,0 +1,30 @@
+import sqlite3
+from flask import current_app
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.local import LocalProxy
+from replicas import RoutingSession
+
+# The extensions are created here without an app and bound to one by create_app (app.py), so models, blueprints and
+# jobs can import them without building an app. Anything made from the config (cache, password hasher, sign in limiter)
+# lives in app.extensions and is reached through a proxy, which resolves to the current apps one.
+
+# read only views may read from replicas (see replicas.py)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# cache for product query results (lru in process, or redis shared by every worker), see cache.py
+cache = LocalProxy(lambda: current_app.extensions['cache'])
+
+# password hashing runs in a bounded process pool, sign in attempts are rate limited per ip and username (see passwords.py)
+hasher = LocalProxy(lambda: current_app.extensions['hasher'])
+signin_limiter = LocalProxy(lambda: current_app.extensions['signin_limiter'])
+
+# pub/sub of the live updates sent to open pages (see events.py)
+hub = LocalProxy(lambda: current_app.extensions['hub'])
+
+# sqlite only enforces foreign keys (and so their ON DELETE CASCADE) when asked to, on every connection
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute('PRAGMA foreign_keys=ON')
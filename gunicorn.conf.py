@@ -0,0 +1,44 @@
+import gc
+import os
+
+# gunicorn -c gunicorn.conf.py wsgi:app
+# With preload_app the app is imported and built once, in the master, and every worker is a fork of it: workers start
+# at once and share the imported code and the app copy on write instead of each building their own.
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+# served behind nginx, which sets X-Forwarded-For (see PROXY_FIX_HOPS in config.py). Set it to 0 when clients reach
+# gunicorn directly
+os.environ.setdefault('PROXY_FIX_HOPS', '1')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+# Every open page holds a connection for its event stream (/events, see events_routes.py) until EVENTS_MAX_SECONDS.
+# With the default gthread workers that is a thread, so only half the threads of a worker may serve streams and the
+# rest stay free for the other routes. To serve many open pages, route /events at the proxy to a second gunicorn
+# started with GUNICORN_WORKER_CLASS=gevent (pip install gevent), where a stream is only a greenlet.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+if worker_class == 'gthread':
+    os.environ.setdefault('EVENTS_MAX_STREAMS', str(max(threads // 2, 1)))
+else:
+    os.environ.setdefault('EVENTS_MAX_STREAMS', str(worker_connections * 9 // 10))
+# the in process hub only reaches pages connected to the worker that published, with more than one worker the events
+# have to go through the database
+if workers > 1:
+    os.environ.setdefault('EVENTS_BACKEND', 'postgres')
+    if os.environ['EVENTS_BACKEND'] != 'postgres':
+        raise RuntimeError(f"EVENTS_BACKEND = '{os.environ['EVENTS_BACKEND']}' only reaches the pages of one worker, use 'postgres' with WEB_CONCURRENCY={workers}")
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+def when_ready(server):
+    # everything allocated so far lives as long as the master, keep the garbage collector from touching it (and so
+    # copying its pages) in the workers
+    gc.freeze()
+
+def post_fork(server, worker):
+    if not server.cfg.preload_app:
+        return
+    # connections the master may have opened belong to it, each worker opens its own
+    from wsgi import app
+    from extensions import db
+    with app.app_context():
+        for engine in list(db.engines.values()) + list(getattr(app.extensions.get('replicas'), 'engines', [])):
+            engine.dispose(close=False)
@@ -1,5 +1,10 @@
+import hashlib
+import hmac
+import json
+from datetime import timezone
 from functools import wraps
-from flask import request, redirect, session, flash
+from flask import current_app, request, redirect, session, flash, g, make_response, Response, stream_template, get_flashed_messages, abort
+from sqlalchemy import text
 
 def logged_in(func):
     @wraps(func)
@@ -7,10 +12,28 @@ def logged_in(func):
         if session.get('userid') is None:
             flash('You\'re not signed in for that action. Attempt signing in.', 'info') 
             return redirect('/signin')
+        # the session can outlive the account (deleted elsewhere), so make sure the user still exists
+        if current_user() is None:
+            session.clear()
+            flash('Your account could not be found. Attempt signing in again.', 'info')
+            return redirect('/signin')
         # is signed in
         return func(*args, **kwargs)
     return wrapper_
 
+def stats_token_required(func):
+    """ For the stats endpoints (/metrics, /cache/stats, /jobs/stats): 404 unless STATS_TOKEN is set, then only
+    requests sent with "Authorization: Bearer <STATS_TOKEN>" get them. """
+    @wraps(func)
+    def wrapper_(*args, **kwargs):
+        token = current_app.config.get('STATS_TOKEN')
+        if not token:
+            abort(404)
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+            abort(403)
+        return func(*args, **kwargs)
+    return wrapper_
+
 def redirect_logged_in(func):
     @wraps(func)
     def wrapper_(*args, **kwargs):
@@ -27,5 +50,108 @@ def none_if_nexist(value):
         return None 
     return value
 
-def get_user_instance(db, User):
-    return db.session.query(User).get(session.get('userid'))
+def normalize_name(name):
+    """ Case folded name with its whitespace collapsed, products are unique per seller by it ("Blue  Pen" == "blue pen"). """
+    return ' '.join(name.split()).casefold() if name else name
+
+# set by the app with @user_loader, takes the userid from the session and returns the user (or None)
+_load_user = None
+
+def user_loader(func):
+    """ Registers the function current_user() uses to load the signed in user. """
+    global _load_user
+    _load_user = func
+    return func
+
+def current_user():
+    """ The signed in user, loaded at most once per request and kept on flask.g. None when signed out or the user does not exist. """
+    if 'current_user' not in g:
+        userid = session.get('userid')
+        g.current_user = _load_user(userid) if userid is not None else None
+    return g.current_user
+
+def keyset_page(query, column, after, per_page):
+    """ Returns (items, next_cursor) for the rows of query after the cursor, ordered by column. next_cursor is None on the last page. """
+    try:
+        after = int(after) if after else None
+    except ValueError:
+        after = None
+    if after is not None:
+        query = query.filter(column > after)
+    # fetching one extra row tells us if there is another page without a COUNT(*)
+    items = query.order_by(column).limit(per_page + 1).all()
+    if len(items) > per_page:
+        items = items[:per_page]
+        return items, getattr(items[-1], column.key)
+    return items, None
+
+def wants_json():
+    """ True when the listing was requested as json (?format=json). """
+    return request.args.get('format') == 'json'
+
+def explain_uses_index(db, query):
+    """ Runs EXPLAIN on a query and returns (uses_index, plan_lines). A plan uses an index when none of its steps is a full table scan. """
+    dialect = db.session.get_bind().dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    try:
+        if dialect.name == 'postgresql':
+            # small tables are cheaper to read whole, so ask if the index *can* be used rather than if it is cheapest right now
+            db.session.execute(text('SET LOCAL enable_seqscan = off'))
+            plan = [row[0] for row in db.session.execute(text(f'EXPLAIN {sql}'))]
+            return not any('Seq Scan' in line for line in plan), plan
+        # sqlite: each row is (id, parent, notused, detail)
+        plan = [row[-1] for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}'))]
+        return not any(line.startswith('SCAN') for line in plan), plan
+    finally:
+        db.session.rollback()
+
+def cart_count():
+    """ The cart count in the header of every page (0 signed out), so it is part of the ETag of every page too. """
+    return g.cart_amount if current_user() else 0
+
+def etag_for(*parts):
+    """ ETag of a response made from parts (anything json can dump, dates included). """
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+def conditional_response(etag, render, last_modified=None):
+    """ 304 when the client already has this version of the page, otherwise render() with validators set.
+    Pages with flash messages waiting are always rendered, the 304 would never show them. """
+    if '_flashes' not in session and _not_modified(etag, last_modified):
+        response = make_response('', 304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # the page depends on who is signed in, keep it out of shared caches and revalidate it every time
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def _not_modified(etag, last_modified):
+    # If-None-Match wins when the client sent it, If-Modified-Since (whole seconds) is only a fallback. Compressed
+    # responses carry the ETag as a weak one, so compare weakly (as If-None-Match is meant to be)
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified and request.if_modified_since:
+        return last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= request.if_modified_since
+    return False
+
+def stream_page(template, chunk_bytes=16384, **context):
+    """ Streams a rendered template, sent in chunks of about chunk_bytes while the rest is still rendering. Pass lazy
+    iterables (query.yield_per) as context, so rows are fetched, rendered and sent a chunk at a time. """
+    # the session is saved before the body renders, so take the flashes out of it now (the template gets them from the request)
+    get_flashed_messages(with_categories=True)
+    return Response(_buffered(stream_template(template, **context), chunk_bytes), mimetype='text/html')
+
+def _buffered(pieces, chunk_bytes):
+    # jinja yields every bit of markup on its own, group them so the server writes a few big chunks
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_bytes:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
@@ -0,0 +1,104 @@
+import hashlib
+import http.client
+import importlib.util
+import io
+import ipaddress
+import os
+import socket
+from urllib.parse import urlparse
+
+# Pillow is optional, without it products keep using their image_link as is. It is only imported by store_image, so
+# web workers (which never resize) do not pay for importing it.
+RESIZING = importlib.util.find_spec('PIL') is not None
+
+# Product images are fetched once from their image_link and kept in a content addressed store:
+#   <store>/<hash[:2]>/<hash>/original
+#   <store>/<hash[:2]>/<hash>/<width>.webp and <width>.jpg
+# where hash is the sha256 of the original. The files under a hash never change, so they can be cached forever.
+
+FORMATS = {'webp': ('WEBP', 'image/webp'), 'jpg': ('JPEG', 'image/jpeg')}
+
+class ImageError(Exception):
+    """ Raised when an image link cannot be fetched or is not an image. """
+
+def check_public_url(url):
+    """ The link comes from a seller, do not let it point us at our own network. Returns the vetted address to connect to. """
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise ImageError(f'Not an http(s) link: {url}')
+    try:
+        infos = socket.getaddrinfo(parsed.hostname, parsed.port or (443 if parsed.scheme == 'https' else 80), type=socket.SOCK_STREAM)
+    except (socket.gaierror, ValueError) as e:
+        raise ImageError(f'Could not resolve {parsed.hostname}: {e}')
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0])
+        if not address.is_global:
+            raise ImageError(f'Refusing to fetch from {address}')
+    return infos[0][4][0]
+
+def _connection(parsed, address, timeout):
+    """ A connection to the host of the link that goes to address instead of looking the host up again: a second lookup
+    could answer with an internal address (DNS rebinding). The Host header and TLS (SNI and certificate) still use the hostname. """
+    connection_class = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+    connection = connection_class(parsed.hostname, parsed.port, timeout=timeout)
+    connection._create_connection = lambda host_port, *args: socket.create_connection((address, host_port[1]), *args)
+    return connection
+
+def fetch_image(url, max_bytes=5 * 1024 * 1024, timeout=10):
+    """ Downloads an image link, refusing anything that is not a public http(s) url, not an image or too big. Redirects are not followed. """
+    address = check_public_url(url)
+    parsed = urlparse(url)
+    path = (parsed.path or '/') + (f'?{parsed.query}' if parsed.query else '')
+    connection = _connection(parsed, address, timeout)
+    try:
+        connection.request('GET', path, headers={'User-Agent': 'SimpleStore image fetcher'})
+        response = connection.getresponse()
+        if response.status != 200:
+            raise ImageError(f'Got {response.status} {response.reason} for {url}')
+        if not response.headers.get('Content-Type', '').startswith('image/'):
+            raise ImageError(f'Not an image: {url}')
+        data = response.read(max_bytes + 1)
+    finally:
+        connection.close()
+    if len(data) > max_bytes:
+        raise ImageError(f'Image is bigger than {max_bytes} bytes: {url}')
+    return data
+
+def image_dir(store_dir, image_hash):
+    return os.path.join(store_dir, image_hash[:2], image_hash)
+
+def store_image(store_dir, data, widths=(320, 640)):
+    """ Stores an original image and its resized variants (needs Pillow), returns the images hash. Storing the same image again is a no-op. """
+    image_hash = hashlib.sha256(data).hexdigest()
+    directory = image_dir(store_dir, image_hash)
+    if os.path.exists(os.path.join(directory, 'original')):
+        return image_hash
+    from PIL import Image
+    try:
+        source = Image.open(io.BytesIO(data))
+        source.load()
+    except Exception as e:
+        raise ImageError(f'Could not read the image: {e}')
+    os.makedirs(directory, exist_ok=True)
+    for width in widths:
+        variant = source.copy()
+        # keeps the aspect ratio, never scales up
+        variant.thumbnail((width, width * 4))
+        variant = variant.convert('RGB')
+        for extension, (pil_format, _) in FORMATS.items():
+            _write(os.path.join(directory, f'{width}.{extension}'), _encode(variant, pil_format))
+    # written last, its presence means every variant is there
+    _write(os.path.join(directory, 'original'), data)
+    return image_hash
+
+def _encode(image, pil_format):
+    buffer = io.BytesIO()
+    image.save(buffer, pil_format, quality=80)
+    return buffer.getvalue()
+
+def _write(path, data):
+    # write then rename, so a reader never sees half a file
+    temp_path = f'{path}.tmp{os.getpid()}'
+    with open(temp_path, 'wb') as temp:
+        temp.write(data)
+    os.replace(temp_path, path)
@@ -0,0 +1,93 @@
+import json
+import time
+from datetime import datetime, timedelta
+
+# A small job queue kept in the database (jobs table). Jobs are added in the same transaction as the change that
+# needs them, so they exist exactly when that change commits. Workers ("flask worker") claim jobs with a conditional
+# UPDATE, retry failures with exponential backoff and give up after max_attempts.
+
+# handlers by job kind, registered with @task
+TASKS = {}
+
+def task(kind):
+    """ Registers the function that runs jobs of this kind, it gets the jobs payload as keyword arguments. """
+    def register(func):
+        TASKS[kind] = func
+        return func
+    return register
+
+def enqueue(db, Job, kind, payload, key=None, max_attempts=5, delay=0):
+    """ Adds a job in the callers transaction. A key makes the job idempotent: enqueueing the same key again does nothing. """
+    if key and db.session.query(Job.id).filter_by(idempotency_key=key).first():
+        return None
+    job = Job(kind=kind, payload=json.dumps(payload), idempotency_key=key, status='queued', attempts=0, max_attempts=max_attempts,
+              run_after=datetime.utcnow() + timedelta(seconds=delay), created_at=datetime.utcnow())
+    db.session.add(job)
+    return job
+
+def claim_job(db, Job, timeout=300):
+    """ Takes the next due job for this worker, or returns None when there is nothing to do. """
+    now = datetime.utcnow()
+    # jobs whose worker died while running them go back in the queue
+    db.session.query(Job).filter((Job.status == 'running') & (Job.started_at < now - timedelta(seconds=timeout))).update({Job.status: 'queued'}, synchronize_session=False)
+    db.session.commit()
+    due = db.session.query(Job.id).filter((Job.status == 'queued') & (Job.run_after <= now)).order_by(Job.run_after, Job.id).limit(10).all()
+    for (job_id,) in due:
+        # only one worker can move a job out of queued, the others see 0 rows and try the next one
+        claimed = (db.session.query(Job).filter((Job.id == job_id) & (Job.status == 'queued'))
+                   .update({Job.status: 'running', Job.attempts: Job.attempts + 1, Job.started_at: now}, synchronize_session=False))
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+    return None
+
+def run_job(db, Job, job):
+    """ Runs one claimed job and records how it went. Returns True when it succeeded. """
+    try:
+        TASKS[job.kind](**json.loads(job.payload))
+        job.status = 'done'
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return True
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        job = db.session.get(Job, job.id)
+        job.last_error = repr(e)
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+        else:
+            # 2, 4, 8, ... seconds between attempts
+            job.status = 'queued'
+            job.run_after = datetime.utcnow() + timedelta(seconds=2 ** job.attempts)
+        db.session.commit()
+        return False
+
+def work(db, Job, once=False, poll_seconds=1.0, timeout=300):
+    """ Runs jobs until stopped, or until the queue is empty when once is True. Returns the number of jobs run. """
+    processed = 0
+    while True:
+        job = claim_job(db, Job, timeout)
+        if job is None:
+            if once:
+                return processed
+            time.sleep(poll_seconds)
+            continue
+        run_job(db, Job, job)
+        processed += 1
+
+def job_stats(db, Job, window=60):
+    """ Queue depth by status and throughput over the last window seconds, read from the jobs table so every process sees the same numbers. """
+    since = datetime.utcnow() - timedelta(seconds=window)
+    counts = dict(db.session.query(Job.status, db.func.count(Job.id)).group_by(Job.status).all())
+    finished = db.session.query(Job.created_at, Job.finished_at).filter((Job.status == 'done') & (Job.finished_at >= since)).all()
+    latency = [(finished_at - created_at).total_seconds() for created_at, finished_at in finished]
+    return {
+        'queued': counts.get('queued', 0),
+        'running': counts.get('running', 0),
+        'done': counts.get('done', 0),
+        'failed': counts.get('failed', 0),
+        'throughput_per_second': len(finished) / window,
+        'average_latency_seconds': sum(latency) / len(latency) if latency else None,
+    }
@@ -0,0 +1,66 @@
+import json
+from collections import namedtuple
+from helpers import keyset_page
+from search import search_products
+
+# orjson is optional, without it listings are serialized by the standard json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Read path of the product listings (catalog, seller pages, search, product page, cart). Only the columns the pages
+# show are selected and each row comes back as a ProductRow namedtuple: no ORM instances, identity map or change
+# tracking for data that is only ever read. Writes keep going through the Product model.
+
+FIELDS = ('id', 'name', 'description', 'price', 'total_stock', 'image_link', 'image_hash', 'userid', 'updated_at')
+ProductRow = namedtuple('ProductRow', FIELDS)
+
+def product_columns(Product):
+    """ The Product columns a ProductRow is made of, in order. """
+    return [getattr(Product, field) for field in FIELDS]
+
+def row_dict(row):
+    """ Json-able dict of a ProductRow, the form listings are cached and served as json in. """
+    values = row._asdict()
+    values['updated_at'] = row.updated_at.isoformat() if row.updated_at else None
+    return values
+
+def catalog_page(db, Product, after, per_page, userid=None):
+    """ One keyset page of the catalog (or of one sellers products), returns (rows, next_cursor). """
+    query = db.session.query(*product_columns(Product)).filter(Product.listed())
+    if userid is not None:
+        query = query.filter(Product.userid == userid)
+    rows, next_cursor = keyset_page(query, Product.id, after, per_page)
+    return [ProductRow._make(row) for row in rows], next_cursor
+
+def product_row(db, Product, product_id):
+    """ One product, or None (also for a product that is no longer sold, see Product.listed). """
+    row = db.session.query(*product_columns(Product)).filter((Product.id == product_id) & Product.listed()).first()
+    return ProductRow._make(row) if row else None
+
+def search_page(db, Product, query, page, per_page):
+    """ One page of search results (see search.py), returns (rows, next_page). """
+    rows, next_page = search_products(db, Product, query, page, per_page, product_columns(Product))
+    return [ProductRow._make(row) for row in rows], next_page
+
+def seller_rows(db, Product, userid, chunk=200):
+    """ Yields every product of a seller, read chunk rows at a time (server side cursor where the database has one). """
+    rows = db.session.query(*product_columns(Product)).filter(Product.userid == userid).order_by(Product.id).yield_per(chunk)
+    for row in rows:
+        yield ProductRow._make(row)
+
+def cart_rows(db, Product, CartLine, cart_id, quantities, chunk=200):
+    """ Yields the products in a cart, read chunk rows at a time. Fills quantities ({product id: units}) as it goes. """
+    rows = (db.session.query(*product_columns(Product), CartLine.quantity).join(CartLine, CartLine.product_id == Product.id)
+            .filter(CartLine.cart_id == cart_id).order_by(CartLine.product_id).yield_per(chunk))
+    for row in rows:
+        product = ProductRow._make(row[:-1])
+        quantities[product.id] = row[-1]
+        yield product
+
+def dumps(data):
+    """ Compact json bytes of data, through orjson when it is installed. """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode()
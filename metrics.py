@@ -0,0 +1,177 @@
+import cProfile
+import io
+import logging
+import pstats
+import threading
+import time
+from flask import Response, current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from helpers import stats_token_required
+
+# Request instrumentation: every request is timed, and the SQL it sends is counted and timed through the engine events
+# (every engine, replicas included). Totals are kept per endpoint in process and served at /metrics in the prometheus
+# text format, each request also gets a Server-Timing header. Statements slower than SLOW_QUERY_SECONDS are logged
+# with their parameters. With PROFILE_REQUESTS = 'header', a request sent with "X-Profile: 1" is answered with its
+# profile (cProfile, or pyinstrument when PROFILER = 'pyinstrument') instead of the page.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+slow_query_log = logging.getLogger('simplestore.slow_queries')
+
+class Metrics:
+    """ Per endpoint request and SQL totals of this process. """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # {(endpoint, method, status): count}
+        self.requests = {}
+        # {endpoint: [count per bucket..., count, sum]}
+        self.durations = {}
+        # {endpoint: [statements, seconds]}, endpoint None is SQL sent outside a request (cli, worker)
+        self.sql = {}
+        self.slow_queries = 0
+
+    def observe_request(self, endpoint, method, status, seconds, statements, sql_seconds):
+        with self._lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.durations.setdefault(endpoint, [0] * (len(BUCKETS) + 2))
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+            self._add_sql(endpoint, statements, sql_seconds)
+
+    def observe_sql(self, endpoint, statements, seconds):
+        with self._lock:
+            self._add_sql(endpoint, statements, seconds)
+
+    def observe_slow_query(self):
+        with self._lock:
+            self.slow_queries += 1
+
+    def _add_sql(self, endpoint, statements, seconds):
+        totals = self.sql.setdefault(endpoint, [0, 0.0])
+        totals[0] += statements
+        totals[1] += seconds
+
+    def render(self):
+        """ The totals in the prometheus text exposition format. """
+        lines = []
+        with self._lock:
+            lines += ['# HELP simplestore_requests_total Requests handled, by endpoint, method and status.',
+                      '# TYPE simplestore_requests_total counter']
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'simplestore_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+            lines += ['# HELP simplestore_request_duration_seconds Time spent handling requests, by endpoint.',
+                      '# TYPE simplestore_request_duration_seconds histogram']
+            for endpoint, histogram in sorted(self.durations.items()):
+                for bound, count in zip(BUCKETS, histogram):
+                    lines.append(f'simplestore_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+                lines.append(f'simplestore_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {histogram[-2]}')
+                lines.append(f'simplestore_request_duration_seconds_count{{endpoint="{endpoint}"}} {histogram[-2]}')
+                lines.append(f'simplestore_request_duration_seconds_sum{{endpoint="{endpoint}"}} {histogram[-1]:.6f}')
+            lines += ['# HELP simplestore_sql_statements_total SQL statements sent, by the endpoint that sent them ("" outside requests).',
+                      '# TYPE simplestore_sql_statements_total counter']
+            for endpoint, (statements, _) in sorted(self.sql.items(), key=lambda item: item[0] or ''):
+                lines.append(f'simplestore_sql_statements_total{{endpoint="{endpoint or ""}"}} {statements}')
+            lines += ['# HELP simplestore_sql_duration_seconds_total Time spent in SQL statements, by endpoint.',
+                      '# TYPE simplestore_sql_duration_seconds_total counter']
+            for endpoint, (_, seconds) in sorted(self.sql.items(), key=lambda item: item[0] or ''):
+                lines.append(f'simplestore_sql_duration_seconds_total{{endpoint="{endpoint or ""}"}} {seconds:.6f}')
+            lines += ['# HELP simplestore_slow_queries_total Statements slower than SLOW_QUERY_SECONDS.',
+                      '# TYPE simplestore_slow_queries_total counter',
+                      f'simplestore_slow_queries_total {self.slow_queries}']
+        return '\n'.join(lines) + '\n'
+
+# registered once for every engine (replicas included), the totals go to the current apps Metrics
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'handle_error')
+def failed_statement(exception_context):
+    # after_cursor_execute does not run for a statement that raised, its start would stay on the (pooled) connection
+    conn = exception_context.connection
+    if conn is not None and exception_context.execution_context is not None and conn.info.get('statement_started'):
+        conn.info['statement_started'].pop()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_statement(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['statement_started'].pop()
+    seconds = time.perf_counter() - started
+    metrics = current_app.extensions.get('metrics') if has_app_context() else None
+    if metrics is None:
+        return
+    if has_request_context():
+        g.sql_statements = g.get('sql_statements', 0) + 1
+        g.sql_seconds = g.get('sql_seconds', 0.0) + seconds
+    else:
+        metrics.observe_sql(None, 1, seconds)
+    if seconds >= current_app.config.get('SLOW_QUERY_SECONDS', 0.1):
+        metrics.observe_slow_query()
+        endpoint = request.endpoint if has_request_context() else None
+        slow_query_log.warning('%.1fms in %s: %s %r', seconds * 1000, endpoint, statement, parameters)
+
+def init_metrics(app):
+    """ Instruments every request and SQL statement of app, and adds the /metrics endpoint. Returns the Metrics. """
+    metrics = Metrics()
+    app.extensions['metrics'] = metrics
+
+    @app.before_request
+    def start_request():
+        g.request_started = time.perf_counter()
+        if app.config.get('PROFILE_REQUESTS') == 'header' and request.headers.get('X-Profile') == '1':
+            g.profiler = _start_profiler(app.config.get('PROFILER', 'cprofile'))
+
+    @app.after_request
+    def end_request(response):
+        if 'request_started' not in g:
+            return response
+        endpoint, method, status = request.endpoint or 'unmatched', request.method, response.status_code
+        if response.is_streamed and g.get('profiler') is None:
+            # a streamed body (stream_page) renders, and runs its queries, after this hook. Its totals are taken once
+            # it is sent, from the same g (the stream runs in this request context). The header goes out first, so it
+            # only has the time until then
+            request_g = g._get_current_object()
+            def end_stream():
+                metrics.observe_request(endpoint, method, status, time.perf_counter() - request_g.request_started,
+                                        request_g.get('sql_statements', 0), request_g.get('sql_seconds', 0.0))
+            response.call_on_close(end_stream)
+            response.headers['Server-Timing'] = f'app;dur={(time.perf_counter() - g.request_started) * 1000:.1f};desc="until the body started"'
+            return response
+        seconds = time.perf_counter() - g.request_started
+        statements, sql_seconds = g.get('sql_statements', 0), g.get('sql_seconds', 0.0)
+        metrics.observe_request(endpoint, method, status, seconds, statements, sql_seconds)
+        response.headers['Server-Timing'] = f'app;dur={seconds * 1000:.1f}, db;dur={sql_seconds * 1000:.1f};desc="{statements} queries"'
+        if g.get('profiler') is not None:
+            return _profile_response(g.pop('profiler'))
+        return response
+
+    @app.route('/metrics')
+    @stats_token_required
+    def metrics_endpoint():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    return metrics
+
+def _start_profiler(profiler):
+    if profiler == 'pyinstrument':
+        # optional dependency, only needed for PROFILER = 'pyinstrument'
+        from pyinstrument import Profiler
+        started = Profiler()
+        started.start()
+        return started
+    started = cProfile.Profile()
+    started.enable()
+    return started
+
+def _profile_response(profiler):
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(40)
+        return Response(output.getvalue(), mimetype='text/plain')
+    profiler.stop()
+    return Response(profiler.output_html(), mimetype='text/html')
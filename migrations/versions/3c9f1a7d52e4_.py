@@ -0,0 +1,28 @@
+"""product full text search
+
+Revision ID: 3c9f1a7d52e4
+Revises: e90f057db57d
+Create Date: 2026-10-18 09:12:41.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9f1a7d52e4'
+down_revision = 'e90f057db57d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # generated tsvector over name (weight A) and description (weight B), searched by search.py
+    op.execute("ALTER TABLE products ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+               "(setweight(to_tsvector('english', coalesce(name, '')), 'A') || setweight(to_tsvector('english', coalesce(description, '')), 'B')) STORED")
+    op.create_index('ix_products_search_vector', 'products', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_products_search_vector', table_name='products')
+    op.drop_column('products', 'search_vector')
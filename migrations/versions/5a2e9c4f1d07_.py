@@ -0,0 +1,39 @@
+"""stock reservations
+
+Revision ID: 5a2e9c4f1d07
+Revises: 8d41e6b0c2a9
+Create Date: 2026-10-18 11:20:54.913402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a2e9c4f1d07'
+down_revision = '8d41e6b0c2a9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stock_reservations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_stock_reservations_expires_at'), 'stock_reservations', ['expires_at'], unique=False)
+    op.create_index(op.f('ix_stock_reservations_product_id'), 'stock_reservations', ['product_id'], unique=False)
+    op.create_index(op.f('ix_stock_reservations_user_id'), 'stock_reservations', ['user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_stock_reservations_user_id'), table_name='stock_reservations')
+    op.drop_index(op.f('ix_stock_reservations_product_id'), table_name='stock_reservations')
+    op.drop_index(op.f('ix_stock_reservations_expires_at'), table_name='stock_reservations')
+    op.drop_table('stock_reservations')
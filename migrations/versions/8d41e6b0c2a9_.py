@@ -0,0 +1,48 @@
+"""indexes for hot lookup columns
+
+Revision ID: 8d41e6b0c2a9
+Revises: 3c9f1a7d52e4
+Create Date: 2026-10-18 10:03:27.581130
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d41e6b0c2a9'
+down_revision = '3c9f1a7d52e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # signup checked for the username before inserting, two signups at once could both get it. The oldest account keeps
+    # the name, the others become <username>-<id> (or <username>-<id>-2, -3... when someone already has that) so the
+    # unique index can be built
+    connection = op.get_bind()
+    users = sa.table('users', sa.column('id', sa.Integer), sa.column('username', sa.String))
+    older = users.alias('older')
+    duplicates = connection.execute(sa.select(users.c.id, users.c.username)
+                                    .where(sa.exists().where((older.c.username == users.c.username) & (older.c.id < users.c.id)))
+                                    .order_by(users.c.id)).all()
+    for user_id, username in duplicates:
+        new_name = f'{username}-{user_id}'
+        suffix = 1
+        while connection.execute(sa.select(users.c.id).where(users.c.username == new_name)).first():
+            suffix += 1
+            new_name = f'{username}-{user_id}-{suffix}'
+        connection.execute(users.update().where(users.c.id == user_id).values(username=new_name))
+    op.create_index(op.f('ix_users_username'), 'users', ['username'], unique=True)
+    op.create_index(op.f('ix_products_userid'), 'products', ['userid'], unique=False)
+    op.create_index(op.f('ix_products_name'), 'products', ['name'], unique=False)
+    op.create_index(op.f('ix_cart_user_id'), 'cart', ['user_id'], unique=False)
+    # cart_products gets its primary key together with the quantity column (c7b3d8e21f56), a repeated row is one more
+    # unit of the product
+
+
+def downgrade():
+    op.drop_index(op.f('ix_cart_user_id'), table_name='cart')
+    op.drop_index(op.f('ix_products_name'), table_name='products')
+    op.drop_index(op.f('ix_products_userid'), table_name='products')
+    op.drop_index(op.f('ix_users_username'), table_name='users')
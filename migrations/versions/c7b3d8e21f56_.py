@@ -0,0 +1,43 @@
+"""cart lines with quantity
+
+Revision ID: c7b3d8e21f56
+Revises: 5a2e9c4f1d07
+Create Date: 2026-10-18 12:41:08.377265
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7b3d8e21f56'
+down_revision = '5a2e9c4f1d07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # every existing row was one unit, repeated rows of a product collapse into one line with their count as quantity
+    op.execute('CREATE TEMPORARY TABLE cart_lines AS SELECT cart_id, product_id, count(*) AS quantity FROM cart_products '
+               'WHERE cart_id IS NOT NULL AND product_id IS NOT NULL GROUP BY cart_id, product_id')
+    op.execute('DELETE FROM cart_products')
+    op.add_column('cart_products', sa.Column('quantity', sa.Integer(), nullable=False))
+    op.execute('INSERT INTO cart_products (cart_id, product_id, quantity) SELECT cart_id, product_id, quantity FROM cart_lines')
+    op.execute('DROP TABLE cart_lines')
+    op.alter_column('cart_products', 'cart_id', existing_type=sa.Integer(), nullable=False)
+    op.alter_column('cart_products', 'product_id', existing_type=sa.Integer(), nullable=False)
+    op.create_primary_key('cart_products_pkey', 'cart_products', ['cart_id', 'product_id'])
+    # the amount is now the sum of the cart lines
+    op.drop_column('cart', 'amount')
+
+
+def downgrade():
+    op.add_column('cart', sa.Column('amount', sa.INTEGER(), autoincrement=False, nullable=False, server_default='0'))
+    op.execute('UPDATE cart SET amount = (SELECT coalesce(sum(quantity), 0) FROM cart_products WHERE cart_products.cart_id = cart.id)')
+    op.alter_column('cart', 'amount', server_default=None)
+    op.drop_constraint('cart_products_pkey', 'cart_products', type_='primary')
+    op.alter_column('cart_products', 'product_id', existing_type=sa.Integer(), nullable=True)
+    op.alter_column('cart_products', 'cart_id', existing_type=sa.Integer(), nullable=True)
+    # back to one row per unit
+    op.execute('INSERT INTO cart_products (cart_id, product_id) SELECT cart_id, product_id FROM cart_products, generate_series(2, quantity)')
+    op.drop_column('cart_products', 'quantity')
@@ -0,0 +1,153 @@
+from datetime import datetime
+from flask import g
+from extensions import db
+from helpers import normalize_name, user_loader
+from search import register_search_index
+
+#------------
+# Models
+#------------
+class User(db.Model):
+  __tablename__ = 'users'
+  id = db.Column(db.Integer, primary_key=True)
+  username = db.Column(db.String(), nullable=False, unique=True, index=True)
+  password = db.Column(db.String(), nullable=False)
+  # set when the account is deleted with ACCOUNT_DELETION = 'soft', the purge_account job removes it and its data later
+  deleted_at = db.Column(db.DateTime, nullable=True)
+  # creating a one to many relationship here.
+  # - cascade all delete, means that when a User is deleted, then delete all of the products associated with the user.
+  # - the foreign keys are ON DELETE CASCADE, passive_deletes leaves it to the database instead of loading every row first
+  products = db.relationship('Product', backref='user', cascade='all, delete', passive_deletes=True)
+  cart = db.relationship('Cart', backref='cart_user', cascade='all, delete', uselist=False, passive_deletes=True)
+  orders = db.relationship('Order', backref='user', cascade='all, delete', passive_deletes=True)
+
+class Product(db.Model):
+    __tablename__ = 'products'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(), nullable=True, index=True)
+    # normalize_name(name), kept in step by set_name below. A seller cannot have two products with the same one.
+    normalized_name = db.Column(db.String(), nullable=True)
+    description = db.Column(db.String(), nullable=False, default='An item you can buy')
+    price = db.Column(db.Float, nullable=False, default=5.0)
+    total_stock = db.Column(db.Integer, nullable=False, default=1)
+    image_link = db.Column(db.String(), nullable=False)
+    # sha256 of the image fetched from image_link, set once its resized copies are in the image store (see images.py)
+    image_hash = db.Column(db.String(64), nullable=True)
+    userid = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), index=True)
+    # bumped by every write, bulk UPDATEs of total_stock included (onupdate), pages showing the product use it as their validator
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    __table_args__ = (db.UniqueConstraint('userid', 'normalized_name', name='uq_products_userid_normalized_name'),)
+
+    @db.validates('name')
+    def set_name(self, key, name):
+        self.normalized_name = normalize_name(name)
+        return name
+
+    @classmethod
+    def listed(cls):
+        """ Condition for the products that are shown and sold: not those of a soft deleted seller, which wait for purge_account. """
+        return ~db.exists().where((User.id == cls.userid) & User.deleted_at.isnot(None))
+
+# keeps the full text search index (tsvector / FTS5) next to the products table
+register_search_index(Product.__table__)
+
+class CartLine(db.Model):
+    """ One product in a cart and how many of it. """
+    __tablename__ = 'cart_products'
+    # - (cart_id, product_id) is the primary key, so looking up a users cart rows is an index scan
+    # - deleting a cart or a product deletes its lines in the database (ON DELETE CASCADE), other users carts included
+    cart_id = db.Column(db.Integer, db.ForeignKey('cart.id', ondelete='CASCADE'), primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=1)
+    product = db.relationship('Product')
+
+class Cart(db.Model):
+    __tablename__ = 'cart'
+    id = db.Column(db.Integer, primary_key=True)
+    # creating a one to one relationship between a cart and parent
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    # bumped whenever a line is added, changed or removed (touch_cart), the cart page uses it as its validator
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # creating a one to many relationship between cart (parent) and its lines, deleting the cart only deletes the lines (never the products)
+    lines = db.relationship('CartLine', backref='cart', cascade='all, delete-orphan', passive_deletes=True)
+    # read only shortcut for templates that list the products in the cart
+    products = db.relationship('Product', secondary='cart_products', viewonly=True)
+
+class StockReservation(db.Model):
+    """ Stock taken out of Product.total_stock while it sits in a users cart (see stock.py). """
+    __tablename__ = 'stock_reservations'
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    quantity = db.Column(db.Integer, nullable=False, default=1)
+    # once expired the stock is given back to the product (release_expired_stock)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class Order(db.Model):
+    __tablename__ = 'orders'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    # sent by the checkout form, placing the same order twice (double submit, retry) returns the first one
+    idempotency_key = db.Column(db.String(), nullable=True)
+    total = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(), nullable=False, default='placed')
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # filled in by the render_order_confirmation job
+    confirmation = db.Column(db.Text, nullable=True)
+    lines = db.relationship('OrderLine', backref='order', cascade='all, delete-orphan', passive_deletes=True)
+    __table_args__ = (db.UniqueConstraint('user_id', 'idempotency_key'),)
+
+class OrderLine(db.Model):
+    """ A product as it was bought, name and price are copied so later edits to the product do not change the order. """
+    __tablename__ = 'order_lines'
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id', ondelete='CASCADE'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='SET NULL'), nullable=True)
+    seller_id = db.Column(db.Integer, nullable=True)
+    name = db.Column(db.String(), nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+
+class Notification(db.Model):
+    """ A message for a user, written by the notify_sellers job when an order buys their products, shown on their account page. """
+    __tablename__ = 'notifications'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    # kept when the buyer deletes their account (and their orders with it)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id', ondelete='SET NULL'), nullable=True)
+    message = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    read_at = db.Column(db.DateTime, nullable=True)
+    # a retried job does not notify a seller twice about one order
+    __table_args__ = (db.UniqueConstraint('user_id', 'order_id'),)
+
+class Job(db.Model):
+    """ Background work queued in the database and run by "flask worker" (see jobs.py). """
+    __tablename__ = 'jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    idempotency_key = db.Column(db.String(), nullable=True, unique=True)
+    status = db.Column(db.String(), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    last_error = db.Column(db.Text, nullable=True)
+    run_after = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    __table_args__ = (db.Index('ix_jobs_status_run_after', 'status', 'run_after'),)
+
+def load_user_query(userid):
+    """ The one query load_user runs: the user, their cart and the number of units in it. """
+    amount = db.select(db.func.coalesce(db.func.sum(CartLine.quantity), 0)).where(CartLine.cart_id == Cart.id).scalar_subquery()
+    return db.session.query(User, amount).outerjoin(User.cart).options(db.contains_eager(User.cart)).filter((User.id == userid) & User.deleted_at.is_(None))
+
+@user_loader
+def load_user(userid):
+    """ Loads the signed in user together with their cart and its count in one query (cart count ends up in g.cart_amount). """
+    row = load_user_query(userid).first()
+    if row is None:
+        return None
+    user, g.cart_amount = row
+    return user
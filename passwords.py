@@ -0,0 +1,100 @@
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_all_start_methods, get_context
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Password hashing is made to be slow, running it on the request thread lets a burst of sign ins starve every other
+# route. Hashes are computed in a small process pool instead, with a cap on how many may wait for it at once.
+
+class HashingBusy(Exception):
+    """ Raised when too many hashes are already waiting for the pool. """
+
+class PasswordHasher:
+    def __init__(self, method='scrypt', workers=2, max_pending=8, wait_seconds=2.0):
+        # werkzeug method string, ex: 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000'
+        self.method = method
+        self.workers = workers
+        self.wait_seconds = wait_seconds
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # what werkzeug expands method to ('scrypt' -> 'scrypt:32768:8:1'), worked out on first use
+        self._prefix = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('PASSWORD_HASH_METHOD', 'scrypt'), config.get('PASSWORD_HASH_WORKERS', 2),
+                   config.get('PASSWORD_HASH_MAX_PENDING', 8), config.get('PASSWORD_HASH_WAIT_SECONDS', 2.0))
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """ True when a stored hash was made with other parameters than the configured ones. """
+        if self._prefix is None:
+            self._prefix = generate_password_hash('', self.method, salt_length=1).split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._prefix
+
+    def _run(self, func, *args):
+        # admission control, refuse right away rather than queue behind a storm
+        if not self._slots.acquire(timeout=self.wait_seconds):
+            raise HashingBusy()
+        try:
+            if not self.workers:
+                return func(*args)
+            return self._get_pool().submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+    def _get_pool(self):
+        # created on first use so each (forked) worker process gets its own. Its processes are started by a forkserver
+        # (where there is one) rather than forked from this threaded worker, which can copy locks held by other threads
+        with self._pool_lock:
+            if self._pool is None:
+                context = get_context('forkserver') if 'forkserver' in get_all_start_methods() else None
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._pool
+
+class RateLimiter:
+    """ Sliding window limit of attempts per key (ip, username), kept in process. """
+    def __init__(self, attempts, seconds):
+        self.attempts = attempts
+        self.seconds = seconds
+        self._hits = {}
+        self._lock = threading.Lock()
+
+    def allow(self, *keys):
+        """ Records an attempt for every key, False when any of them is over the limit. """
+        now = time.monotonic()
+        allowed = True
+        with self._lock:
+            for key in keys:
+                hits = self._hits.setdefault(key, deque())
+                while hits and hits[0] <= now - self.seconds:
+                    hits.popleft()
+                if len(hits) >= self.attempts:
+                    allowed = False
+                else:
+                    hits.append(now)
+            # forget keys that went quiet so the dict does not grow forever
+            if len(self._hits) > 10000:
+                self._hits = {key: hits for key, hits in self._hits.items() if hits and hits[-1] > now - self.seconds}
+        return allowed
+
+    def retry_after(self, *keys):
+        """ Whole seconds until every key is under the limit again (0 when they are now). """
+        now = time.monotonic()
+        wait = 0
+        with self._lock:
+            for key in keys:
+                hits = [hit for hit in self._hits.get(key, ()) if hit > now - self.seconds]
+                if len(hits) >= self.attempts:
+                    # the oldest hits leave the window first, this one brings the key back under the limit
+                    wait = max(wait, hits[len(hits) - self.attempts] + self.seconds - now)
+        return math.ceil(wait)
@@ -0,0 +1,263 @@
+import re
+import json
+from datetime import datetime
+from flask import Blueprint, current_app, render_template, session, flash, request, redirect, abort, send_from_directory, Response, stream_with_context
+from sqlalchemy.exc import IntegrityError
+from extensions import db, cache
+from models import Product, CartLine, Job
+from helpers import logged_in, none_if_nexist, current_user, wants_json, etag_for, conditional_response, stream_page, cart_count
+from store import json_response, invalidate_products, stock_changed, products_in_cart, run_import
+from jobs import enqueue
+from images import FORMATS, image_dir
+from replicas import use_replica
+from listings import catalog_page, product_row, seller_rows, row_dict
+from bulk import FORMATS as EXPORT_FORMATS, BulkError, import_format, read_rows, export_products
+from assets import static_version
+from stock import adjust_stock
+
+# The catalog, a sellers products (adding, editing, bulk import / export) and the product images.
+bp = Blueprint('products', __name__)
+
+def render_listing(template, namespace, seller_id=None, **context):
+  """ Renders one keyset page of the catalog (or of one sellers products), or its json variant when ?format=json is given. Pages are cached under namespace. """
+  after = request.args.get('after')
+  def load_page():
+    # plain rows of the shown columns, see listings.py
+    products, next_cursor = catalog_page(db, Product, after, current_app.config['PRODUCTS_PER_PAGE'], seller_id)
+    return {'products': [row_dict(product) for product in products], 'next': next_cursor}
+  page = cache.get_or_set(namespace, [after, current_app.config['PRODUCTS_PER_PAGE']], load_page)
+  if wants_json():
+    return conditional_response(etag_for(page), lambda: json_response(page))
+  products = page['products']
+  in_cart = products_in_cart(products)
+  # the page is fully described by the products shown (updated_at included), which of them are in the cart, who is looking
+  # and the cart count in its header
+  etag = etag_for(template, page, sorted(in_cart), context, cart_count(), static_version(current_app.static_folder, current_app.config['ASSETS_BUILD_DIR']))
+  return conditional_response(etag, lambda: render_template(template, products=none_if_nexist(products), next_cursor=page['next'], in_cart=in_cart, **context))
+
+@bp.route('/')
+@use_replica
+def index():
+  if session.get('userid'):
+    return render_listing('/pages/home.html', 'catalog', userid=session.get('userid'))
+  else:
+      return render_template('/layouts/main.html', userid=None)
+
+################################### Products route controllers 
+@bp.route('/products')
+@logged_in
+@use_replica
+def getProducts():
+    """ Shows all the users products / options """
+    userid = session.get('userid')
+    if request.args.get('all'):
+        return stream_all_products(userid)
+    return render_listing('/pages/user_products.html', f'seller:{userid}', seller_id=userid, userid=userid)
+
+def stream_all_products(userid):
+    """ Every product of a seller on one page, streamed: read STREAM_YIELD_PER rows at a time and sent as it renders. """
+    user = current_user()
+    count, updated_at = db.session.query(db.func.count(Product.id), db.func.max(Product.updated_at)).filter(Product.userid == userid).one()
+    in_cart = {product_id for (product_id,) in db.session.query(CartLine.product_id).filter(CartLine.cart_id == user.cart.id)}
+    etag = etag_for('seller-all', userid, count, updated_at, sorted(in_cart), cart_count(), static_version(current_app.static_folder, current_app.config['ASSETS_BUILD_DIR']))
+    products = seller_rows(db, Product, userid, current_app.config['STREAM_YIELD_PER'])
+    return conditional_response(etag, lambda: stream_page('/pages/user_products.html', products=products, in_cart=in_cart, userid=userid), updated_at)
+@bp.route('/products/new')
+@logged_in
+def new_product():
+    return render_template('/pages/new_product.html', userid=session.get('userid'))
+@bp.route('/products/new', methods=['POST'])
+@logged_in
+def new_product_submission():
+    name = request.form.get('name')
+    description = request.form.get('description')
+    price = request.form.get('price')
+    total_stock = request.form.get('total_stock')
+    image_link = request.form.get('image_link')
+
+    if not name or not description or not price or not total_stock or not image_link:
+        flash('Missing required field\'s. Try again.', 'error')
+        return redirect('/products/new')
+
+    try:
+        # add the product to the page
+        temp = Product(name=name, description=description, price=price, total_stock=total_stock, image_link=image_link, userid=session.get('userid')) 
+        db.session.add(temp)
+        db.session.flush()
+        # fetched and resized by the worker, until then the product shows image_link itself
+        enqueue(db, Job, 'process_product_image', {'product_id': temp.id, 'image_link': image_link}, max_attempts=current_app.config['JOB_MAX_ATTEMPTS'])
+        db.session.commit()
+        invalidate_products(session.get('userid'))
+    except IntegrityError as e:
+        # product cannot have duplicate name, the unique (userid, normalized_name) index says so even for two tabs at once
+        print(e)
+        db.session.rollback()
+        flash('A product with that name already exist', 'error')
+        return redirect('/products/new')
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        flash('Could not add the product to the database...Please try again', 'error')
+        return redirect('/products/new')
+
+    flash('Added the prodct to the database!', 'success')
+    return redirect('/products')
+@bp.route('/products/<int:product_id>')
+@use_replica
+def get_product_info(product_id):
+    """ Runs when \"see more \" is clicked displays more options for the item """
+    def load_product():
+        product = product_row(db, Product, product_id)
+        return row_dict(product) if product else None
+    # misses (None) are not kept by the cache, so a product created later still shows up
+    product = cache.get_or_set('product', [product_id], load_product)
+
+    # check if product exist
+    if not product:
+        flash('Hmm...Product does not exist anymore.', 'info')
+        return redirect('/')
+
+    # send back information about the product, or 304 when the browser already has this version of it
+    in_cart = products_in_cart([product])
+    etag = etag_for('product', product, sorted(in_cart), session.get('userid'), cart_count(), static_version(current_app.static_folder, current_app.config['ASSETS_BUILD_DIR']))
+    last_modified = datetime.fromisoformat(product['updated_at']) if product.get('updated_at') else None
+    return conditional_response(etag, lambda: render_template('/pages/view_product.html', products=[product], in_cart=in_cart, userid=session.get('userid')), last_modified)
+@bp.route('/products/<int:product_id>/put')
+@logged_in
+def update_product(product_id):
+    """ Edit product page (only available fo the owner """
+    product = db.session.query(Product).get(product_id)
+    if product.userid != session.get('userid'):
+        flash('You\'re not the owner of this product.', 'error')
+        return redirect('/')
+    return render_template('/pages/update_product.html', product=product)
+@bp.route('/products/<int:product_id>/put', methods=['POST'])
+@logged_in
+def update_product_submission(product_id):
+    product = db.session.query(Product).get(product_id)
+
+    # check that the product exists
+    if not product:
+        flash('Could not find this product in our database.', 'info')
+        return redirect(f'/products/{{product_id}}')
+
+    # check that the product contains the same userid as currently in session
+    if product.userid != session.get('userid'):
+        flash('You cannnot edit a product that does not belong to you.', 'error')
+        return redirect('/')
+    
+    name = request.form.get('name')
+    description = request.form.get('description')
+    price = request.form.get('price')
+    image_link = request.form.get('image_link')
+
+    # only update the necessary things that need to be updated
+    if name != product.name:
+        product.name = name
+    if description != product.description:
+        product.description = description
+    if price != product.price:
+        product.price = price
+    if image_link != product.image_link:
+        product.image_link = image_link
+        # the stored copies are of the old image, show the new link until the worker has fetched it
+        product.image_hash = None
+        enqueue(db, Job, 'process_product_image', {'product_id': product.id, 'image_link': image_link}, max_attempts=current_app.config['JOB_MAX_ATTEMPTS'])
+
+    try:
+        total_stock, shown_stock = int(request.form.get('total_stock')), int(request.form.get('shown_stock'))
+    except (TypeError, ValueError):
+        db.session.rollback()
+        flash('Could not read the stock. Reload the form and try again.', 'error')
+        return redirect(f'/products/{product_id}/put')
+
+    try:
+        # the stock is not overwritten with the number the form showed: carts may have taken (or given back) some since
+        # the form was rendered, so only the sellers change is applied, in one conditional UPDATE
+        if total_stock != shown_stock and not adjust_stock(db, Product, product.id, total_stock - shown_stock):
+            db.session.rollback()
+            flash('Carts took more of this product since you opened the form than you are taking away. Check the stock and try again.', 'error')
+            return redirect(f'/products/{product_id}/put')
+        # commit transactions (updates)
+        db.session.commit()
+        invalidate_products(product.userid, [product.id])
+        stock_changed([product.id])
+        flash('Updated your product!', 'success')
+        return redirect('/products')
+    except IntegrityError as e:
+        print(e)
+        db.session.rollback()
+        flash('You already have another product with that name.', 'error')
+        return redirect(f'/products/{product_id}/put')
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        flash('Could not updated your product. Try again.', 'error')
+        return redirect('/products/{{product_id}}/put')
+
+#----------------
+# Bulk import / export
+#----------------
+@bp.route('/products/import')
+@logged_in
+def import_products_page():
+    return render_template('/pages/import_products.html', report=None, userid=session.get('userid'))
+
+@bp.route('/products/import', methods=['POST'])
+@logged_in
+def import_products_submission():
+    """ Imports an uploaded csv / json lines file of products. Json clients get the report after every batch, one json object per line. """
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Choose a .csv or .jsonl file to import.', 'error')
+        return redirect('/products/import')
+    try:
+        format = import_format(upload.filename, request.form.get('format'))
+    except BulkError as e:
+        flash(str(e), 'error')
+        return redirect('/products/import')
+    stream = upload.stream
+    reports = run_import(session.get('userid'), read_rows(stream, format))
+
+    if wants_json():
+        # the request closes its files when the view returns, keep the upload open for the streamed response
+        upload.stream = None
+        def progress():
+            try:
+                for report in reports:
+                    yield json.dumps(report) + '\n'
+            except BulkError as e:
+                yield json.dumps({'error': str(e)}) + '\n'
+            finally:
+                stream.close()
+        return Response(stream_with_context(progress()), mimetype='application/x-ndjson')
+
+    report = None
+    try:
+        for report in reports:
+            pass
+    except BulkError as e:
+        flash(str(e), 'error')
+        return redirect('/products/import')
+    flash(f'Imported {report["imported"]} products.', 'success' if report['imported'] else 'info')
+    return render_template('/pages/import_products.html', report=report, userid=session.get('userid'))
+
+@bp.route('/products/export')
+@logged_in
+def export_products_download():
+    """ Streams the sellers products as a csv or json lines download, a page of rows at a time. """
+    format = request.args.get('format', 'csv')
+    if format not in EXPORT_FORMATS:
+        abort(404)
+    rows = export_products(db, Product, session.get('userid'), format, current_app.config['IMPORT_BATCH_SIZE'])
+    return Response(stream_with_context(rows), mimetype=EXPORT_FORMATS[format], headers={'Content-Disposition': f'attachment; filename=products.{format}'})
+
+@bp.route('/images/<image_hash>/<int:width>.<extension>')
+def product_image(image_hash, width, extension):
+    """ Serves a resized product image. The path names its content, so it is cached for good and revalidated by ETag. """
+    if not re.fullmatch(r'[0-9a-f]{64}', image_hash) or width not in current_app.config['IMAGE_WIDTHS'] or extension not in FORMATS:
+        abort(404)
+    response = send_from_directory(image_dir(current_app.config['IMAGE_STORE_DIR'], image_hash), f'{width}.{extension}', mimetype=FORMATS[extension][1], max_age=31536000, conditional=True, etag=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
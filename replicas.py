@@ -0,0 +1,111 @@
+import random
+import threading
+import time
+from functools import wraps
+import sqlalchemy as sa
+from flask import current_app, g, has_request_context, session
+from flask_sqlalchemy.session import Session
+
+# Read only views (catalog, search, product pages) can be served by read replicas, everything else goes to the primary.
+# Routing happens per statement in RoutingSession.get_bind: only plain SELECTs (text() ones too) of a view marked with @use_replica go to
+# a replica. A replica lagging more than REPLICA_MAX_LAG_SECONDS (or not answering) is skipped until its next check,
+# with no healthy replica the reads simply stay on the primary. After a request writes, that browser reads from the
+# primary for REPLICA_STICKY_SECONDS so it sees its own change even through a lagging replica.
+
+class ReplicaSet:
+    """ Engines of the read replicas and how far behind each one is, checked at most every check_seconds. """
+    def __init__(self, engines, max_lag=5, check_seconds=5):
+        self.engines = engines
+        self.max_lag = max_lag
+        self.check_seconds = check_seconds
+        # {engine: (checked at, healthy)}
+        self._checks = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        options = config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        engines = [sa.create_engine(uri, **options) for uri in config.get('SQLALCHEMY_REPLICA_URIS', ())]
+        return cls(engines, config.get('REPLICA_MAX_LAG_SECONDS', 5), config.get('REPLICA_CHECK_SECONDS', 5))
+
+    def pick(self):
+        """ A random healthy replica, or None when there is none (use the primary). """
+        healthy = [engine for engine in self.engines if self._healthy(engine)]
+        return random.choice(healthy) if healthy else None
+
+    def _healthy(self, engine):
+        now = time.monotonic()
+        with self._lock:
+            checked = self._checks.get(engine)
+            if checked and checked[0] > now - self.check_seconds:
+                return checked[1]
+            # claim the check, requests arriving meanwhile use the previous answer
+            self._checks[engine] = (now, checked[1] if checked else False)
+        try:
+            healthy = replica_lag(engine) <= self.max_lag
+        except Exception as e:
+            print(e)
+            healthy = False
+        with self._lock:
+            self._checks[engine] = (time.monotonic(), healthy)
+        return healthy
+
+def replica_lag(engine):
+    """ Seconds a replica is behind its primary. Only postgres can tell, other databases count as up to date when they answer. """
+    with engine.connect() as connection:
+        if engine.dialect.name != 'postgresql':
+            connection.execute(sa.text('SELECT 1'))
+            return 0
+        # an idle primary makes the last replay look old, so nothing left to replay counts as no lag
+        lag = connection.execute(sa.text(
+            'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+            'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END')).scalar()
+        return lag or 0
+
+def use_replica(view):
+    """ Marks a read only view, its SELECTs may be served by a replica. Goes under @app.route (and @logged_in). """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.use_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+def _reads_from_replica():
+    return (has_request_context() and g.get('use_replica') and not g.get('db_wrote')
+            and session.get('primary_until', 0) < time.time())
+
+def _is_read(clause):
+    """ A plain SELECT, written with the query builder or as text() (no FOR UPDATE either way). """
+    if getattr(clause, 'is_select', False):
+        return getattr(clause, '_for_update_arg', None) is None
+    if isinstance(clause, sa.TextClause):
+        sql = ' '.join(clause.text.split()).upper()
+        return sql.startswith('SELECT ') and ' FOR UPDATE' not in sql and ' FOR SHARE' not in sql
+    return False
+
+class RoutingSession(Session):
+    """ Flask-SQLAlchemy session sending the SELECTs of @use_replica views to a replica (see the top of replicas.py). """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if self._flushing or getattr(clause, 'is_dml', False):
+                if has_request_context():
+                    g.db_wrote = True
+            elif _is_read(clause) and _reads_from_replica():
+                replicas = current_app.extensions.get('replicas')
+                engine = replicas.pick() if replicas else None
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def init_replicas(app):
+    """ Sets up the replicas listed in SQLALCHEMY_REPLICA_URIS, with none every query goes to the primary. """
+    replicas = ReplicaSet.from_config(app.config)
+    if replicas.engines:
+        app.extensions['replicas'] = replicas
+
+    @app.after_request
+    def stick_to_primary(response):
+        if g.get('db_wrote') and app.extensions.get('replicas'):
+            session['primary_until'] = time.time() + app.config.get('REPLICA_STICKY_SECONDS', 10)
+        return response
+    return replicas
@@ -0,0 +1,94 @@
+import re
+from sqlalchemy import DDL, Float, Integer, event, func, literal_column, text
+
+# words are what we index and match on, everything else in a query is ignored
+WORD = re.compile(r'\w+', re.UNICODE)
+
+#------------
+# Index setup
+#------------
+# postgres keeps a generated tsvector column (name weighted above description) with a GIN index on it.
+POSTGRES_DDL = [
+    "ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS "
+    "(setweight(to_tsvector('english', coalesce(name, '')), 'A') || setweight(to_tsvector('english', coalesce(description, '')), 'B')) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_products_search_vector ON products USING GIN (search_vector)",
+]
+# sqlite (used for local runs and tests) gets an external content FTS5 table kept in sync by triggers.
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(name, description, content='products', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN "
+    "INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+]
+
+def register_search_index(table):
+    """ Creates the search index alongside the products table whenever it is created through create_all(). Production databases get it from the migration. """
+    for statement in POSTGRES_DDL:
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+    for statement in SQLITE_DDL:
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+
+#------------
+# Querying
+#------------
+def search_words(query):
+    """ Splits a raw search query into the lower cased words we match on. """
+    return [word.lower() for word in WORD.findall(query or '')]
+
+def search_products(db, Product, query, page=1, per_page=24, columns=None):
+    """ Ranked full text search over product name and description.
+    Every word has to match first. When that finds nothing the words are relaxed so that any of them matching is enough.
+    Only listed products are found (Product.listed). Returns (products, next_page), next_page is None on the last page. With columns (Product.id first) the products are
+    rows of those columns instead of Product instances. """
+    words = search_words(query)
+    if not words:
+        return [], None
+    page = max(page, 1)
+    offset = (page - 1) * per_page
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        search = _postgres_search
+    elif dialect == 'sqlite':
+        search = _sqlite_search
+    else:
+        search = _like_search
+
+    entities = columns or [Product]
+    products = search(db, Product, entities, words, True, offset, per_page + 1)
+    # related products, when matching all of the words results in nothing (later pages of a relaxed search stay relaxed)
+    if not products and len(words) > 1 and (page == 1 or not search(db, Product, [Product.id], words, True, 0, 1)):
+        products = search(db, Product, entities, words, False, offset, per_page + 1)
+    if len(products) > per_page:
+        return products[:per_page], page + 1
+    return products, None
+
+def _postgres_search(db, Product, entities, words, match_all, offset, limit):
+    # prefix matching (word:*) keeps "lap" finding "laptop" like the old LIKE search did
+    tsquery = func.to_tsquery('english', (' & ' if match_all else ' | ').join(f'{word}:*' for word in words))
+    vector = literal_column('products.search_vector')
+    return (db.session.query(*entities)
+            .filter(vector.op('@@')(tsquery) & Product.listed())
+            .order_by(func.ts_rank_cd(vector, tsquery).desc(), Product.id)
+            .offset(offset).limit(limit).all())
+
+def _sqlite_search(db, Product, entities, words, match_all, offset, limit):
+    match = (' ' if match_all else ' OR ').join(f'"{word}"*' for word in words)
+    # the match is joined to the products, so products that are not listed do not use up a page
+    matches = (text('SELECT rowid, rank FROM products_fts WHERE products_fts MATCH :match').bindparams(match=match)
+               .columns(rowid=Integer, rank=Float).subquery())
+    return (db.session.query(*entities).join(matches, matches.c.rowid == Product.id)
+            .filter(Product.listed())
+            .order_by(matches.c.rank, Product.id)
+            .offset(offset).limit(limit).all())
+
+def _like_search(db, Product, entities, words, match_all, offset, limit):
+    """ Unindexed fallback for databases without full text search. """
+    clauses = [Product.name.ilike(f'%{word}%') | Product.description.ilike(f'%{word}%') for word in words]
+    condition = clauses[0]
+    for clause in clauses[1:]:
+        condition = (condition & clause) if match_all else (condition | clause)
+    return db.session.query(*entities).filter(condition & Product.listed()).order_by(Product.id).offset(offset).limit(limit).all()
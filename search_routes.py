@@ -0,0 +1,40 @@
+from flask import Blueprint, current_app, render_template, session, request
+from extensions import db, cache
+from models import Product
+from helpers import logged_in, wants_json, etag_for, conditional_response, cart_count
+from store import json_response, products_in_cart
+from search import search_words
+from replicas import use_replica
+from listings import search_page, row_dict
+from assets import static_version
+
+# Product search (see search.py for the index and the ranking).
+bp = Blueprint('search', __name__)
+
+#----------
+# Search Routes
+#----------
+@bp.route('/search')
+@logged_in
+@use_replica
+def search():
+    query = request.args.get('query')
+    products = None
+    next_page = None
+    if query:
+        try:
+            page = int(request.args.get('page', 1))
+        except ValueError:
+            page = 1
+        per_page = current_app.config['PRODUCTS_PER_PAGE']
+        def load_results():
+            # ranked and paginated, see search.py for how the index is built and how words are relaxed
+            products, next_page = search_page(db, Product, query, page, per_page)
+            return {'products': [row_dict(product) for product in products], 'next': next_page}
+        results = cache.get_or_set('search', [' '.join(search_words(query)), page, per_page], load_results)
+        if wants_json():
+            return conditional_response(etag_for(results), lambda: json_response(results))
+        products, next_page = results['products'], results['next']
+    in_cart = products_in_cart(products)
+    etag = etag_for('search', query, products, next_page, sorted(in_cart), session.get('userid'), cart_count(), static_version(current_app.static_folder, current_app.config['ASSETS_BUILD_DIR']))
+    return conditional_response(etag, lambda: render_template('/pages/search.html', userid=session.get('userid'), products=products, in_cart=in_cart, query=query, next_page=next_page))
@@ -0,0 +1,37 @@
+import os
+from flask_session import Session
+
+# The session only ever holds userid and username, so by default it lives in flasks own signed cookie: no storage,
+# no lookups and every worker can read it as long as they share SECRET_KEY. The server side backends are still
+# available through Flask-Session for when the session has to be revocable or grows.
+BACKENDS = ('cookie', 'redis', 'sqlalchemy', 'memory', 'filesystem')
+
+def init_session(app, db):
+    """ Sets up the session interface described by SESSION_BACKEND. """
+    backend = app.config.get('SESSION_BACKEND', 'cookie')
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown SESSION_BACKEND {backend!r}, expected one of {", ".join(BACKENDS)}')
+
+    if backend == 'cookie':
+        # flasks default SecureCookieSessionInterface, signed with SECRET_KEY
+        return
+    if backend == 'redis':
+        # optional dependency, only needed for this backend. One pool per worker, shared by every request.
+        import redis
+        pool = redis.ConnectionPool.from_url(app.config['SESSION_REDIS_URL'], max_connections=app.config.get('SESSION_REDIS_MAX_CONNECTIONS', 10))
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis.Redis(connection_pool=pool)
+    elif backend == 'sqlalchemy':
+        # sessions table in our own database, going through the same engine (and connection pool) as the app
+        app.config['SESSION_TYPE'] = 'sqlalchemy'
+        app.config['SESSION_SQLALCHEMY'] = db
+    elif backend == 'memory':
+        # local stand in for the shared backends (tests, single process runs), sessions vanish on restart
+        from cachelib import SimpleCache
+        app.config['SESSION_TYPE'] = 'cachelib'
+        app.config['SESSION_CACHELIB'] = SimpleCache()
+    elif backend == 'filesystem':
+        app.config['SESSION_TYPE'] = 'filesystem'
+        # in the instance folder rather than a temp dir per process, so every worker (and restart) sees the same sessions
+        app.config.setdefault('SESSION_FILE_DIR', os.path.join(app.instance_path, 'sessions'))
+    Session(app)
@@ -0,0 +1,64 @@
+import os
+import mimetypes
+from flask import Blueprint, current_app, render_template, request, jsonify, send_file, send_from_directory
+from extensions import db, cache
+from models import Job
+from jobs import job_stats
+from helpers import stats_token_required
+from assets import asset_url, asset_urls, split_fingerprint, file_digest, built_variant
+
+# Fingerprinted static files, the stats endpoints and the error pages.
+bp = Blueprint('site', __name__)
+
+#-----------
+# Static files
+#-----------
+# templates link to static files through asset_url('css/main.css'), an /assets url carrying the files fingerprint, and
+# to bundles through asset_urls('js/logged_in.js'): the built bundle, or its source files when nothing was built
+@bp.app_context_processor
+def inject_asset_url():
+    return {'asset_url': lambda filename: asset_url(current_app.static_folder, filename),
+            'asset_urls': lambda name: asset_urls(current_app.static_folder, current_app.config['ASSETS_BUILD_DIR'], current_app.config['ASSET_BUNDLES'], name)}
+
+@bp.route('/assets/<path:filename>')
+def fingerprinted_asset(filename):
+    """ Serves a static file by its fingerprinted name. The name changes with the content, so it is cached for good. """
+    built = built_variant(current_app.config['ASSETS_BUILD_DIR'], filename, request.accept_encodings)
+    if built:
+        path, encoding = built
+        # a built bundle, or its gzip / brotli copy made by "flask build-assets". send_file hands the open file to the
+        # server (wsgi.file_wrapper, sendfile under gunicorn) rather than reading it into python
+        response = send_file(path, mimetype=mimetypes.guess_type(filename)[0], conditional=True, etag=True, max_age=31536000)
+        if encoding:
+            response.content_encoding = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+    filename, digest = split_fingerprint(filename)
+    response = send_from_directory(current_app.static_folder, filename, conditional=True, etag=True)
+    if digest and digest == file_digest(os.path.join(current_app.static_folder, filename)):
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    else:
+        # an old (or made up) fingerprint gets the current file, but only for a short while
+        response.cache_control.max_age = 60
+    return response
+
+# api route, how the background job queue is keeping up
+@bp.route('/jobs/stats')
+@stats_token_required
+def jobs_stats():
+    return jsonify(job_stats(db, Job))
+
+# api route, how well the cache is doing per namespace family ('product', 'catalog', 'seller', ...)
+@bp.route('/cache/stats')
+@stats_token_required
+def cache_stats():
+    return jsonify(cache.stats)
+
+@bp.app_errorhandler(404)
+def others(e):
+    return render_template('/pages/error.html'), 404
+# TODO add more custom error handlers
@@ -1,78 +1,74 @@
+// the cart count is rendered with the page and kept up to date by the events stream (see main.js)
 const cart = document.querySelector(".cart_notif");
-if (!cart) {
-  alert("Could not find the cart");
-} else {
-  // this should run on load of the page
-  // update the cart with appropriate amount
-  fetch('/cart/amount')
-  .then(async r => await r.json())
-  .then((r) => {
-    // update the cart p with this result
-    cart.innerText = r.amount;
-  })
-  .catch((e) => {console.error(e)})
-}
 
 const getIdFromProduct = (obj) => {
   return obj.parentElement.getAttribute("name");
 }
 
-function addToCart(obj) {
-  try {
-    id = getIdFromProduct(obj);
-    // make a ajax post request with the item this person wants to add to their cart 
-    fetch("/cart/add", {
-        method: "POST",
-        body: JSON.stringify({id}),
-        headers: new Headers({
-          "Content-Type": "application/json"
-        })
-     })
-    .then(async r => await r.json()) 
-    .then((r) => {
-      if (r.result) {
-        cart.innerText = (+cart.innerText) + 1;
-        obj.disabled = true;
-        obj.parentElement.querySelector(".inCart").classList.toggle("hidden");
-        obj.classList.toggle("disabled");
-      }else {
-        alert(r.message);
-      }
-    })
-
-    // if successful increment their cart icon 
-
-  } catch(e) {
-    console.print("Error should be because could not find cart. Nothing serious");
-    console.error(e);
+// Cart changes are queued and sent together to /cart/batch, so rapid clicks cost one request (and one transaction).
+const pendingOperations = [];
+var flushTimer = null;
+const queueCartOperation = (operation, done) => {
+  pendingOperations.push({operation, done});
+  if (!flushTimer) {
+    flushTimer = setTimeout(flushCartOperations, 150);
   }
 }
-
-function removeFromCart(obj) {
-  id = getIdFromProduct(obj);
-  // make a fetch request to the web server to (ajax) to remove this product
-  fetch("/cart/remove", {
+const flushCartOperations = () => {
+  const batch = pendingOperations.splice(0, pendingOperations.length);
+  flushTimer = null;
+  fetch("/cart/batch", {
     method: "POST",
-    body: JSON.stringify({id}),
+    body: JSON.stringify({operations: batch.map(queued => queued.operation)}),
     headers: new Headers({
       "Content-Type": "application/json"
     })
   })
   .then(async r => await r.json())
-  .then((r) => { 
+  .then((r) => {
+    if (r.result) {
+      cart.innerText = r.amount;
+    }
+    // every queued click gets its own result back, in the order it was queued
+    batch.forEach((queued, i) => queued.done(r.result ? r.results[i] : {result: false, message: r.message || "Could not update your cart. Try again."}));
+  })
+  .catch((e) => {
+    console.error(e);
+    // no answer (network error, not json), the queued clicks failed and their buttons are enabled again
+    batch.forEach((queued) => queued.done({result: false, message: "Could not reach the store. Check your connection and try again."}));
+  })
+}
+
+function addToCart(obj) {
+  id = getIdFromProduct(obj);
+  // disabled right away so the same product is not queued twice
+  obj.disabled = true;
+  queueCartOperation({op: "add", id}, (r) => {
     if (r.result) {
-      // decrement from cart
-      cart.innerText = (+cart.innerText) - 1;
+      obj.parentElement.querySelector(".inCart").classList.remove("hidden");
+      obj.classList.add("disabled");
+    } else {
+      obj.disabled = false;
+      alert(r.message);
+    }
+  })
+}
+
+function removeFromCart(obj) {
+  id = getIdFromProduct(obj);
+  obj.disabled = true;
+  queueCartOperation({op: "remove", id}, (r) => {
+    if (r.result) {
+      // every unit of the product was removed
       obj.parentElement.parentElement.removeChild(obj.parentElement);
     } else {
+      obj.disabled = false;
       // TODO: when failed refresh the page? So you can show a flash message instead ?
-      alert("Could not remove ", id, " from your cart. Refreh and try again")
+      alert("Could not remove " + id + " from your cart. Refresh and try again")
     }
   })
 }
 
-// On load of the page, load the cart notif with users cart amount
-
 const deleteButton = document.querySelector("#delete");
 if (deleteButton) {
   const deleteForm = deleteButton.parentElement;
@@ -88,24 +84,40 @@ if (deleteButton) {
 }
 
 const addButton = document.querySelectorAll('.addProduct');
+const markInCart = (button) => {
+  button.parentElement.querySelector(".inCart").classList.remove('hidden');
+  // does exist in our cart, do not allow to add
+  button.disabled = true;
+  button.classList.add("disabled");
+}
 const determineInCart = async () => {
-  for (button of addButton) {
-    try {
-      var r = await fetch('/cart/'+ button.parentElement.getAttribute("name")+'/exist')
-      r = await r.json();
-      if (!r.result) {
-        button.disabled = false;
+  // products the server already marked while rendering the page do not need a lookup
+  const unknown = Array.from(addButton).filter(button => !button.parentElement.hasAttribute("data-in-cart"));
+  if (!unknown.length) {
+    return;
+  }
+  try {
+    // one request for every product on the page instead of one per product
+    var r = await fetch('/cart/exist', {
+      method: "POST",
+      body: JSON.stringify({ids: unknown.map(button => button.parentElement.getAttribute("name"))}),
+      headers: new Headers({
+        "Content-Type": "application/json"
+      })
+    })
+    r = await r.json();
+    const inCart = new Set(r.in_cart.map(String));
+    for (button of unknown) {
+      if (inCart.has(button.parentElement.getAttribute("name"))) {
+        markInCart(button);
       } else {
-        button.parentElement.querySelector(".inCart").classList.remove('hidden');
-        // does exist in our cart, do not allow to add
-        button.disabled = true;
-        button.classList.toggle("disabled");
+        button.disabled = false;
       }
-    } catch(e) {
-      console.error(e);
     }
+  } catch(e) {
+    console.error(e);
   }
 }
-if (addButton) {
+if (addButton.length) {
   determineInCart();
 }
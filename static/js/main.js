@@ -2,3 +2,65 @@ function closeFlash(obj) {
   // removing the current error from parent
   obj.parentElement.parentElement.removeChild(obj.parentElement);
 }
+
+// Live updates pushed by the server (/events): the cart count in the header and the stock of the products on the page.
+// The stream starts with the current values, so a page shown from the browser cache is brought up to date too. Each
+// stream holds a server connection, so it is closed while the tab is hidden and opened again when it is shown.
+// When the server is serving all the streams it can it answers 204, the browser gives up and the page keeps the
+// values it was rendered with.
+const liveProducts = Array.from(document.querySelectorAll(".product_view")).map(view => view.getAttribute("name"));
+let liveEvents = null;
+
+function showCart(e) {
+  const notif = document.querySelector(".cart_notif");
+  if (notif) {
+    notif.innerText = JSON.parse(e.data).amount;
+  }
+}
+
+function showStock(e) {
+  const product = JSON.parse(e.data);
+  document.querySelectorAll('.product_view[name="' + product.id + '"]').forEach((view) => {
+    const stock = view.querySelector(".stock");
+    if (stock) {
+      stock.innerText = product.total_stock;
+    }
+    // out of stock products cannot be added, products already in the cart stay disabled either way
+    const add = view.querySelector(".addProduct");
+    const inCart = view.querySelector(".inCart");
+    if (add && !(inCart && !inCart.classList.contains("hidden"))) {
+      add.disabled = product.total_stock == 0;
+      add.classList.toggle("disabled", product.total_stock == 0);
+    }
+  });
+}
+
+function openLiveEvents() {
+  if (liveEvents === null) {
+    // past EVENTS_MAX_PRODUCTS the ids would not fit in the url, the page gets every stock change and picks its own
+    const products = liveProducts.length > Number(document.body.dataset.eventsMaxProducts || 200) ? "all" : liveProducts.join(",");
+    liveEvents = new EventSource("/events?products=" + products);
+    liveEvents.addEventListener("cart", showCart);
+    liveEvents.addEventListener("stock", showStock);
+  }
+}
+
+function closeLiveEvents() {
+  if (liveEvents !== null) {
+    liveEvents.close();
+    liveEvents = null;
+  }
+}
+
+if (window.EventSource && (liveProducts.length || document.querySelector(".cart_notif"))) {
+  document.addEventListener("visibilitychange", () => {
+    if (document.hidden) {
+      closeLiveEvents();
+    } else {
+      openLiveEvents();
+    }
+  });
+  if (!document.hidden) {
+    openLiveEvents();
+  }
+}
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+from sqlalchemy import delete
+
+# Stock is taken from products.total_stock the moment a product goes into a cart and is held by a reservation row.
+# Every change to total_stock is a single conditional UPDATE, so concurrent requests never read-modify-write the
+# row in python and the database never lets the stock go below zero (no overselling, no SELECT ... FOR UPDATE).
+
+def take_stock(db, Product, product_id, quantity):
+    """ Takes quantity units of a product for good. Returns False (and changes nothing) when there is not enough stock. """
+    return bool(db.session.query(Product)
+                .filter((Product.id == product_id) & (Product.total_stock >= quantity))
+                .update({Product.total_stock: Product.total_stock - quantity}, synchronize_session=False))
+
+def give_back_stock(db, Product, product_id, quantity):
+    """ Puts quantity units back into a products stock. """
+    db.session.query(Product).filter(Product.id == product_id).update({Product.total_stock: Product.total_stock + quantity}, synchronize_session=False)
+
+def adjust_stock(db, Product, product_id, delta):
+    """ Adds delta units (takes them away when negative) to a products stock, as its seller edited it. Returns False
+    (and changes nothing) when that would take the stock below zero. """
+    return bool(db.session.query(Product)
+                .filter((Product.id == product_id) & (Product.total_stock + delta >= 0))
+                .update({Product.total_stock: Product.total_stock + delta}, synchronize_session=False))
+
+def reserve_stock(db, Product, StockReservation, product_id, user_id, quantity=1, minutes=15):
+    """ Takes quantity units of a product for a user. Returns False (and changes nothing) when there is not enough stock.
+    Runs in the callers transaction, so rolling back also gives the stock back. """
+    if not take_stock(db, Product, product_id, quantity):
+        return False
+    db.session.add(StockReservation(product_id=product_id, user_id=user_id, quantity=quantity, expires_at=datetime.utcnow() + timedelta(minutes=minutes)))
+    return True
+
+def release_stock(db, Product, StockReservation, user_id, product_id=None):
+    """ Gives back the stock a user is holding, for one product or (product_id=None) for all of them. Returns {product_id: units released}. """
+    condition = StockReservation.user_id == user_id
+    if product_id is not None:
+        condition = condition & (StockReservation.product_id == product_id)
+    return _release(db, Product, StockReservation, condition)
+
+def shrink_stock(db, Product, StockReservation, user_id, product_id, quantity, minutes=15):
+    """ Gives back quantity of the units a user holds of one product, keeping the rest reserved. Returns the units given back. """
+    held = _delete_reservations(db, StockReservation, (StockReservation.user_id == user_id) & (StockReservation.product_id == product_id)).get(product_id, 0)
+    given_back = min(quantity, held)
+    if given_back:
+        give_back_stock(db, Product, product_id, given_back)
+    if held > given_back:
+        db.session.add(StockReservation(product_id=product_id, user_id=user_id, quantity=held - given_back, expires_at=datetime.utcnow() + timedelta(minutes=minutes)))
+    return given_back
+
+def release_expired_stock(db, Product, StockReservation, now=None):
+    """ Gives back the stock held by reservations that ran out. Returns {product_id: units released}. """
+    return _release(db, Product, StockReservation, StockReservation.expires_at < (now or datetime.utcnow()))
+
+def consume_stock(db, StockReservation, user_id):
+    """ Turns a users reservations into a sale: the stock stays taken and the reservation rows go away. Returns {product_id: units}. """
+    return _delete_reservations(db, StockReservation, StockReservation.user_id == user_id)
+
+def _delete_reservations(db, StockReservation, condition):
+    # DELETE ... RETURNING hands each reservation row to exactly one transaction, so stock is never given back (or sold) twice
+    rows = db.session.execute(delete(StockReservation).where(condition)
+                              .returning(StockReservation.product_id, StockReservation.quantity))
+    units = {}
+    for product_id, quantity in rows:
+        units[product_id] = units.get(product_id, 0) + quantity
+    return units
+
+def _release(db, Product, StockReservation, condition):
+    released = _delete_reservations(db, StockReservation, condition)
+    for product_id, quantity in released.items():
+        give_back_stock(db, Product, product_id, quantity)
+    return released
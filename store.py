@@ -0,0 +1,61 @@
+from flask import Response, current_app
+from extensions import db, cache, hub
+from models import Product, CartLine, Job
+from helpers import current_user
+from jobs import enqueue
+from listings import dumps
+from bulk import import_products
+
+# Store logic shared by the blueprints, the jobs and the cli commands.
+
+def json_response(data):
+  """ Json response for the listings api, serialized by listings.dumps (orjson when installed). """
+  return Response(dumps(data), mimetype='application/json')
+
+def invalidate_products(userid, product_ids=()):
+  """ Drops the cached entries a write to a sellers products can change: the products themselves, every listing page and every search. """
+  for product_id in product_ids:
+    cache.delete('product', product_id)
+  cache.invalidate('catalog', 'search', f'seller:{userid}')
+
+def stock_changed(product_ids):
+  """ Drops the cached copies of products whose stock changed and pushes their new total_stock to the pages showing them. """
+  product_ids = set(product_ids)
+  for product_id in product_ids:
+    cache.delete('product', product_id)
+  # the stock is only read back for products some page is watching
+  watched = [int(topic.split(':')[1]) for topic in hub.listened({f'product:{product_id}' for product_id in product_ids})]
+  if watched:
+    for id_, total_stock in db.session.query(Product.id, Product.total_stock).filter(Product.id.in_(watched)):
+      hub.publish(f'product:{id_}', 'stock', {'id': id_, 'total_stock': total_stock})
+
+def cart_changed(user_id, amount):
+  """ Pushes a users new cart count to their open pages (other tabs included). """
+  hub.publish(f'user:{user_id}', 'cart', {'amount': amount})
+
+def product_id(product):
+    """ Id of a product given as a model, a cached dict or the id itself. """
+    if isinstance(product, dict):
+        return product['id']
+    return getattr(product, 'id', product)
+
+def products_in_cart(products):
+    """ Set of the given product ids (or products) that are in the signed in users cart, found with one query against cart_products. """
+    ids = [product_id(product) for product in products or []]
+    user = current_user()
+    if not ids or user is None or user.cart is None:
+        return set()
+    rows = db.session.query(CartLine.product_id).filter((CartLine.cart_id == user.cart.id) & (CartLine.product_id.in_(ids)))
+    return {row.product_id for row in rows}
+
+def queue_product_images(inserted):
+    """ Queues the image job of every product added in bulk, in the same transaction as the products. """
+    for product_id, image_link in inserted:
+        enqueue(db, Job, 'process_product_image', {'product_id': product_id, 'image_link': image_link}, max_attempts=current_app.config['JOB_MAX_ATTEMPTS'])
+
+def run_import(userid, rows):
+    """ import_products with the configured batch size, yields the report after every batch. """
+    try:
+        yield from import_products(db, Product, userid, rows, current_app.config['IMPORT_BATCH_SIZE'], current_app.config['IMPORT_MAX_ERRORS'], queue_product_images)
+    finally:
+        invalidate_products(userid)
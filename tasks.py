@@ -0,0 +1,85 @@
+from flask import current_app, render_template
+from sqlalchemy import delete
+from extensions import db
+from models import User, Product, StockReservation, Order, Notification
+from store import invalidate_products, stock_changed
+from stock import release_expired_stock
+from jobs import task
+from images import RESIZING, ImageError, fetch_image, store_image
+
+#----------
+# Background jobs (run by "flask worker")
+#----------
+@task('render_order_confirmation')
+def render_order_confirmation(order_id):
+    """ The confirmation shown on the order page. """
+    order = db.session.get(Order, order_id)
+    # the buyers account (and its orders with it) was deleted before the job ran
+    if order is None:
+        return
+    order.confirmation = render_template('/orders/confirmation.txt', order=order)
+    db.session.commit()
+
+@task('process_product_image')
+def process_product_image(product_id, image_link):
+    """ Fetches a products image once and stores its resized copies, so pages stop loading full size images from other hosts. """
+    if not RESIZING:
+        print('Pillow is not installed, product images are served from their image_link')
+        return
+    product = db.session.get(Product, product_id)
+    # the link changed again since, the job queued for the newer link takes care of it
+    if not product or product.image_link != image_link:
+        return
+    try:
+        data = fetch_image(image_link, current_app.config['IMAGE_MAX_BYTES'], current_app.config['IMAGE_FETCH_TIMEOUT'])
+        image_hash = store_image(current_app.config['IMAGE_STORE_DIR'], data, current_app.config['IMAGE_WIDTHS'])
+    except ImageError as e:
+        # a bad link will not get better by retrying, keep showing it as is
+        print(e)
+        return
+    db.session.query(Product).filter((Product.id == product_id) & (Product.image_link == image_link)).update({Product.image_hash: image_hash}, synchronize_session=False)
+    db.session.commit()
+    invalidate_products(product.userid, [product_id])
+
+@task('purge_account')
+def purge_account(user_id):
+    """ Deletes a soft deleted account: its products ACCOUNT_PURGE_BATCH at a time, a short transaction each, then the account itself. """
+    while True:
+        product_ids = [id_ for (id_,) in db.session.query(Product.id).filter_by(userid=user_id).order_by(Product.id).limit(current_app.config['ACCOUNT_PURGE_BATCH'])]
+        if not product_ids:
+            break
+        # their cart lines and reservations go with them (ON DELETE CASCADE)
+        db.session.execute(delete(Product).where(Product.id.in_(product_ids)))
+        db.session.commit()
+        invalidate_products(user_id, product_ids)
+    # the cart, its lines and the orders cascade from the account
+    db.session.execute(delete(User).where((User.id == user_id) & User.deleted_at.isnot(None)))
+    db.session.commit()
+
+@task('notify_sellers')
+def notify_sellers(order_id):
+    """ Leaves every seller of the products an order bought a notification of what it bought. """
+    if not current_app.config['SELLER_NOTIFICATIONS']:
+        return
+    order = db.session.get(Order, order_id)
+    if order is None:
+        return
+    sold = {}
+    for line in order.lines:
+        sold.setdefault(line.seller_id, []).append(line)
+    # sellers whose account is gone, and those notified by an earlier try of this job, are skipped
+    sellers = {id_ for (id_,) in db.session.query(User.id).filter(User.id.in_([id_ for id_ in sold if id_ is not None]) & User.deleted_at.is_(None))}
+    notified = {id_ for (id_,) in db.session.query(Notification.user_id).filter_by(order_id=order.id)}
+    for seller_id in sorted(sellers - notified):
+        message = f'Order #{order.id} bought ' + ', '.join(f'{line.quantity} x {line.name}' for line in sold[seller_id])
+        db.session.add(Notification(user_id=seller_id, order_id=order.id, message=message))
+    db.session.commit()
+
+@task('reconcile_stock')
+def reconcile_stock(order_id):
+    """ Gives back stock held by carts that were abandoned, so what the order sold out is available again when it can be. """
+    released = release_expired_stock(db, Product, StockReservation)
+    db.session.commit()
+    order = db.session.get(Order, order_id)
+    sold = {line.product_id for line in order.lines if line.product_id is not None} if order is not None else set()
+    stock_changed(set(released) | sold)
@@ -0,0 +1,71 @@
+import pytest
+from app import create_app
+from extensions import db
+from models import User, Cart, Product
+
+# Two sqlite files stand in for the primary and its replica. They hold different rows on purpose, so every page
+# shows which of the two it was read from:
+#
+#   python -m pytest tests
+
+def make_app(tmp_path, replica_uri, **config):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "primary.sqlite"}', 'SQLALCHEMY_REPLICA_URIS': [replica_uri],
+                      'REPLICA_STICKY_SECONDS': 0, 'SECRET_KEY': 'test', **config})
+    with app.app_context():
+        db.create_all()
+        add_rows(db.session, 'primary')
+        replicas = app.extensions['replicas']
+        for engine in replicas.engines:
+            try:
+                db.metadata.create_all(engine)
+                with db.Session(bind=engine) as session:
+                    add_rows(session, 'replica')
+            except Exception:
+                # the replica that is down, left as is
+                pass
+    return app
+
+def add_rows(session, where):
+    seller = User(id=1, username='seller', password='x')
+    session.add_all([seller, Cart(id=1, cart_user=seller), Product(id=1, name=f'{where} pen', description=f'a pen on the {where}', image_link='https://example.com/x.png', userid=1)])
+    session.commit()
+
+@pytest.fixture
+def app(tmp_path):
+    app = make_app(tmp_path, f'sqlite:///{tmp_path / "replica.sqlite"}')
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+        for engine in app.extensions['replicas'].engines:
+            engine.dispose()
+
+def signed_in(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['userid'] = 1
+    return client
+
+def test_read_only_views_read_from_the_replica(app):
+    response = app.test_client().get('/products/1')
+    assert b'replica pen' in response.data
+
+def test_search_matches_and_loads_on_the_same_database(app):
+    client = signed_in(app)
+    # only the replica's index knows the word, matching on the primary would find nothing
+    products = client.get('/search?query=replica&format=json').json['products']
+    assert [product['name'] for product in products] == ['replica pen']
+    assert client.get('/search?query=primary&format=json').json['products'] == []
+
+def test_writes_go_to_the_primary(app):
+    client = signed_in(app)
+    client.get('/cart/clear')
+    client.post('/cart/add', json={'id': 1})
+    with app.app_context():
+        assert db.session.get(Product, 1).total_stock == 0
+        with db.Session(bind=app.extensions['replicas'].engines[0]) as session:
+            assert session.get(Product, 1).total_stock == 1
+
+def test_reads_fall_back_to_the_primary_without_a_healthy_replica(tmp_path):
+    app = make_app(tmp_path, f'sqlite:///{tmp_path / "missing" / "replica.sqlite"}')
+    response = app.test_client().get('/products/1')
+    assert b'primary pen' in response.data
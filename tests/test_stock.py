@@ -0,0 +1,62 @@
+import os
+import threading
+import pytest
+from app import create_app
+from extensions import db
+from models import User, Product, StockReservation
+from stock import reserve_stock
+
+# Many carts asking for the last units of one product at once, every request in its own thread and session:
+#
+#   python -m pytest tests                                  # a fresh sqlite database in a temp dir
+#   DATABASE_URL=postgresql://... python -m pytest tests    # a scratch database, the test adds its own rows
+
+THREADS = 32
+STOCK = 5
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': os.environ.get('DATABASE_URL', f'sqlite:///{tmp_path / "stock.sqlite"}'), 'SECRET_KEY': 'test'})
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+def test_reserve_stock_never_oversells(app):
+    with app.app_context():
+        buyers = [User(username=f'stock-test-{os.getpid()}-{i}', password='x') for i in range(THREADS)]
+        seller = User(username=f'stock-test-{os.getpid()}-seller', password='x')
+        db.session.add_all(buyers + [seller])
+        db.session.flush()
+        product = Product(name=f'Last units {os.getpid()}', total_stock=STOCK, image_link='https://example.com/x.png', userid=seller.id)
+        db.session.add(product)
+        db.session.commit()
+        product_id, buyer_ids = product.id, [buyer.id for buyer in buyers]
+
+    # every thread waits at the barrier, so the reservations really race
+    start = threading.Barrier(THREADS)
+    results = []
+    errors = []
+    def buy(user_id):
+        with app.app_context():
+            try:
+                start.wait()
+                reserved = reserve_stock(db, Product, StockReservation, product_id, user_id)
+                db.session.commit()
+                results.append(reserved)
+            except Exception as e:
+                db.session.rollback()
+                errors.append(e)
+    threads = [threading.Thread(target=buy, args=(user_id,)) for user_id in buyer_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert results.count(True) == STOCK
+    assert results.count(False) == THREADS - STOCK
+    with app.app_context():
+        assert db.session.get(Product, product_id).total_stock == 0
+        assert db.session.query(StockReservation).filter_by(product_id=product_id).count() == STOCK